@@ -0,0 +1,97 @@
+"""
+Show the latency of active-task queries as the history of completed tasks grows, with and without the archive.
+
+For each history size, completed tasks are added to the task table and the active queries are timed,
+then the completed tasks are archived and the queries are timed again.
+It adds up to a million completed tasks, so run it against a development database.
+
+Usage: DJANGO_SETTINGS_MODULE=core.settings PYTHONPATH=src/taskhub python benchmarks/archive.py
+"""
+
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+import django
+
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+
+from core.archive import archive_tasks  # noqa: E402
+from core.board import compute_board  # noqa: E402
+from core.models import ArchivedTask, Task  # noqa: E402
+from core.pgcopy import copy_tasks  # noqa: E402
+from core.serializers import task_rows  # noqa: E402
+from core.services import get_ref  # noqa: E402
+
+ACTIVE = 5_000
+HISTORY = [0, 100_000, 300_000, 1_000_000]
+RUNS = 10
+
+QUERIES = {
+    "board": lambda: compute_board(20),
+    "most urgent": lambda: task_rows(Task.objects.filter(completion_date__isnull=True).order_by("-urgency")[:100]),
+    "column": lambda: task_rows(Task.objects.filter(status="pending").order_by("manual_order")[:100]),
+}
+
+
+def add_tasks(count, completed):
+    now = timezone.now()
+    tasks = (
+        Task(
+            id=uuid.uuid4(),
+            title="Task {}".format(i),
+            status="completed" if completed else "pending",
+            manual_order=i,
+            creation_date=now - timedelta(days=400),
+            completion_date=now - timedelta(days=365) if completed else None,
+        )
+        for i in range(count)
+    )
+    copy_tasks(tasks, get_ref=get_ref, progress_every=0)
+
+
+def median_ms(query):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        query()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def measure():
+    return {name: median_ms(query) for name, query in QUERIES.items()}
+
+
+def main():
+    active = Task.objects.filter(completion_date__isnull=True).count()
+    if active < ACTIVE:
+        add_tasks(ACTIVE - active, completed=False)
+
+    results = []
+    for size in HISTORY:
+        # the history of the previous size was archived
+        add_tasks(size, completed=True)
+        in_table = measure()
+        archive_tasks(progress=False)
+        archived = measure()
+        results.append((size, in_table, archived))
+
+    print("")
+    print("Summary (median ms over {} runs, {} active tasks)".format(RUNS, ACTIVE))
+    print("-------")
+    for size, in_table, archived in results:
+        for name in QUERIES:
+            print(
+                "{:>9} completed  {:<12} in table {:>9.1f}   archived {:>9.1f}".format(
+                    size, name, in_table[name], archived[name]
+                )
+            )
+    print("Archived tasks: {}".format(ArchivedTask.objects.count()))
+
+
+if __name__ == "__main__":
+    main()
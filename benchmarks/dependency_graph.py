@@ -0,0 +1,71 @@
+"""
+Time the dependency graph queries on a synthetic graph of 100k tasks and 100k dependencies.
+
+The graph is built in memory, the database is not used.
+
+Usage: DJANGO_SETTINGS_MODULE=core.settings PYTHONPATH=src/taskhub python benchmarks/dependency_graph.py
+"""
+
+import random
+import time
+import uuid
+from datetime import timedelta
+
+import django
+
+django.setup()
+
+from core.graph import DependencyGraph  # noqa: E402
+
+TASKS = 100_000
+EDGES = 100_000
+
+
+def build():
+    random.seed(0)
+    graph = DependencyGraph()
+    ids = [uuid.uuid4() for _ in range(TASKS)]
+    for i, task_id in enumerate(ids):
+        done = random.random() < 0.3
+        duration = timedelta(hours=random.randint(1, 8))
+        graph.set_task(task_id, "done" if done else None, duration, duration * 2)
+    for _ in range(EDGES):
+        # edges go forward in the list, so the graph is acyclic...
+        i = random.randrange(TASKS - 1)
+        graph.add_edge(ids[i], ids[random.randrange(i + 1, min(i + 1000, TASKS))])
+    # ...except for this cycle
+    graph.add_edge(ids[-1], ids[-3])
+    graph.add_edge(ids[-3], ids[-2])
+    graph.add_edge(ids[-2], ids[-1])
+    return graph
+
+
+def timed(label, function):
+    start = time.perf_counter()
+    result = function()
+    print("{:<24} {:>8.1f}ms".format(label, (time.perf_counter() - start) * 1000))
+    return result
+
+
+def main():
+    graph = timed("build", build)
+    blocked = timed("blocked", graph.blocked)
+    unblocked = timed("unblocked", graph.unblocked)
+    order = timed("topological order", graph.topological_order)
+    timed("topological order (cached)", graph.topological_order)
+    cycles = timed("cycles", graph.cycles)
+    path = timed("critical path", graph.critical_path)
+    timed("critical path (min)", lambda: graph.critical_path("min"))
+
+    print("")
+    print("Summary")
+    print("-------")
+    print("Blocked       {} tasks".format(len(blocked)))
+    print("Unblocked     {} tasks".format(len(unblocked)))
+    print("Sorted        {} tasks".format(len(order)))
+    print("Cycles        {}".format([len(cycle) for cycle in cycles]))
+    print("Critical path {} tasks, {}".format(len(path["tasks"]), timedelta(seconds=path["duration"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Compare the REST and GraphQL payloads of the GitHub service, served by a local stand-in server.
+
+The server returns 100 synthetic issues per page, in the REST format (see the GitHubService docstring)
+and in the GraphQL format (see GRAPHQL_QUERY in taskhub.core.services.github).
+We measure the bytes on the wire and the JSON decoding time for each.
+
+GraphQL pages are served in a finite, cursor-paginated set, and the real GraphQL client
+of the GitHub service is run against it first, to validate the pagination and the conversion of nodes.
+
+Usage: DJANGO_SETTINGS_MODULE=core.settings PYTHONPATH=src/taskhub python benchmarks/github_graphql.py
+"""
+
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import django
+
+django.setup()
+
+from core.services.github import GRAPHQL, SEARCH, GitHubService, fetch_shard  # noqa: E402
+
+PAGES = 50
+PER_PAGE = 100
+
+
+def rest_user(login):
+    api = "https://api.github.com/users/" + login
+    return {
+        "login": login,
+        "id": 1,
+        "node_id": "MDQ6VXNlcjE=",
+        "avatar_url": "https://github.com/images/error/{}_happy.gif".format(login),
+        "gravatar_id": "",
+        "url": api,
+        "html_url": "https://github.com/" + login,
+        "followers_url": api + "/followers",
+        "following_url": api + "/following{/other_user}",
+        "gists_url": api + "/gists{/gist_id}",
+        "starred_url": api + "/starred{/owner}{/repo}",
+        "subscriptions_url": api + "/subscriptions",
+        "organizations_url": api + "/orgs",
+        "repos_url": api + "/repos",
+        "events_url": api + "/events{/privacy}",
+        "received_events_url": api + "/received_events",
+        "type": "User",
+        "site_admin": False,
+    }
+
+
+def rest_issue(number):
+    repo = "octocat/Hello-World"
+    api = "https://api.github.com/repos/" + repo
+    url = "{}/issues/{}".format(api, number)
+    return {
+        "id": number,
+        "node_id": "MDU6SXNzdWUx",
+        "url": url,
+        "repository_url": api,
+        "labels_url": url + "/labels{/name}",
+        "comments_url": url + "/comments",
+        "events_url": url + "/events",
+        "html_url": "https://github.com/{}/issues/{}".format(repo, number),
+        "number": number,
+        "state": "open",
+        "title": "Found a bug",
+        "body": "I'm having a problem with this.",
+        "user": rest_user("octocat"),
+        "labels": [
+            {
+                "id": 208045946,
+                "node_id": "MDU6TGFiZWwyMDgwNDU5NDY=",
+                "url": api + "/labels/bug",
+                "name": "bug",
+                "description": "Something isn't working",
+                "color": "f29513",
+                "default": True,
+            }
+        ],
+        "assignee": rest_user("octocat"),
+        "assignees": [rest_user("octocat")],
+        "milestone": None,
+        "locked": True,
+        "active_lock_reason": "too heated",
+        "comments": 0,
+        "pull_request": {
+            "url": api + "/pulls/{}".format(number),
+            "html_url": "https://github.com/{}/pull/{}".format(repo, number),
+            "diff_url": "https://github.com/{}/pull/{}.diff".format(repo, number),
+            "patch_url": "https://github.com/{}/pull/{}.patch".format(repo, number),
+        },
+        "closed_at": None,
+        "created_at": "2011-04-22T13:33:48Z",
+        "updated_at": "2011-04-22T13:33:48Z",
+    }
+
+
+def graphql_node(number):
+    return {
+        "title": "Found a bug",
+        "createdAt": "2011-04-22T13:33:48Z",
+        "closedAt": None,
+        "url": "https://github.com/octocat/Hello-World/issues/{}".format(number),
+        "state": "OPEN",
+        "labels": {"nodes": [{"name": "bug"}]},
+        "repository": {"nameWithOwner": "octocat/Hello-World", "isArchived": False},
+    }
+
+
+def graphql_page(page):
+    return json.dumps(
+        {
+            "data": {
+                "search": {
+                    "pageInfo": {"hasNextPage": page < PAGES - 1, "endCursor": str(page + 1)},
+                    "nodes": [graphql_node(page * PER_PAGE + n) for n in range(PER_PAGE)],
+                }
+            }
+        }
+    ).encode()
+
+
+REST_PAGE = json.dumps([rest_issue(n) for n in range(PER_PAGE)]).encode()
+GRAPHQL_PAGES = [graphql_page(page) for page in range(PAGES)]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def respond(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(REST_PAGE)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        cursor = (body.get("variables") or {}).get("cursor")
+        self.respond(GRAPHQL_PAGES[int(cursor) if cursor else 0])
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(request):
+    size = 0
+    decode_time = 0
+    start = time.time()
+    for _ in range(PAGES):
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+        size += len(body)
+        decode_start = time.time()
+        json.loads(body.decode())
+        decode_time += time.time() - decode_start
+    return size, decode_time, time.time() - start
+
+
+def check_client(url):
+    """Fetch every page with the real GraphQL client and check that each issue is returned once, as a task."""
+    job = (SEARCH, "org:octocat")
+    issues = fetch_shard("token", [job], api=GRAPHQL, graphql_url=url)[job]
+    urls = {issue["html_url"] for issue in issues}
+    assert len(issues) == len(urls) == PAGES * PER_PAGE, "expected {} issues, got {} ({} unique)".format(
+        PAGES * PER_PAGE, len(issues), len(urls)
+    )
+    task = GitHubService(tokens="token").to_generic_task(issues[0])
+    assert task["githuburl"] == "https://github.com/octocat/Hello-World/issues/0", task
+    print("GraphQL client: {} issues from {} pages".format(len(issues), PAGES))
+
+
+def main():
+    server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/".format(server.server_port)
+
+    check_client(url)
+
+    rest = measure(urllib.request.Request(url))
+    graphql = measure(urllib.request.Request(url, data=json.dumps({"query": "..."}).encode()))
+    server.shutdown()
+
+    print("{} pages of {} issues".format(PAGES, PER_PAGE))
+    print("{:<8} {:>12} {:>12} {:>12}".format("api", "bytes", "decode (s)", "total (s)"))
+    for name, (size, decode_time, total) in (("rest", rest), ("graphql", graphql)):
+        print("{:<8} {:>12} {:>12.3f} {:>12.3f}".format(name, size, decode_time, total))
+    print("ratio    {:>12.1f} {:>12.1f}".format(rest[0] / graphql[0], rest[1] / graphql[1]))
+
+
+if __name__ == "__main__":
+    main()
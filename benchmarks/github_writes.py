@@ -0,0 +1,146 @@
+"""
+Validate the GitHub issue writer against a local mock API, and measure its throughput.
+
+The mock API stores issues in memory, sends rate limit headers, and randomly answers
+with secondary rate limit errors (403 with Retry-After) and server errors, to exercise pacing and retries.
+Some server errors are sent after the issue was created, as a gateway timeout would:
+each issue must still be created exactly once. Plain 403 errors (permissions) must not be retried.
+
+Usage: DJANGO_SETTINGS_MODULE=core.settings PYTHONPATH=src/taskhub python benchmarks/github_writes.py
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import django
+
+django.setup()
+
+from core.services.github import IssueWriter, with_marker  # noqa: E402
+
+ISSUES = 200
+ERROR_RATE = 0.05
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    issues = {}
+    posts = 0
+    lock = threading.Lock()
+
+    def respond(self, code, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_payload(self):
+        return json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode())
+
+    def random_error(self):
+        if random.random() < ERROR_RATE:
+            self.respond(403, {"message": "secondary rate limit"}, {"Retry-After": "1"})
+            return True
+        if random.random() < ERROR_RATE:
+            self.respond(502, {"message": "bad gateway"})
+            return True
+        return False
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        with self.lock:
+            issues = sorted(self.issues.values(), key=lambda i: i["number"], reverse=query.get("direction") == ["desc"])
+        self.respond(200, issues[(page - 1) * per_page : page * per_page])
+
+    def do_POST(self):
+        repo = re.match(r"/repos/([^/]+/[^/]+)/issues", self.path).group(1)
+        payload = self.read_payload()
+        with self.lock:
+            MockAPIHandler.posts += 1
+        if repo == "octocat/forbidden":
+            self.respond(403, {"message": "Resource not accessible by integration"})
+            return
+        if self.random_error():
+            return
+        with self.lock:
+            number = len(self.issues) + 1
+            issue = dict(payload, number=number, state="open")
+            issue["html_url"] = "https://github.com/{}/issues/{}".format(repo, number)
+            self.issues[number] = issue
+        if random.random() < ERROR_RATE:
+            # the issue was created, but the client doesn't know it
+            self.respond(504, {"message": "gateway timeout"})
+            return
+        self.respond(201, issue)
+
+    def do_PATCH(self):
+        if self.random_error():
+            return
+        number = int(self.path.rsplit("/", 1)[1])
+        payload = self.read_payload()
+        with self.lock:
+            self.issues[number].update(payload)
+            issue = dict(self.issues[number])
+        self.respond(200, issue)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = "http://127.0.0.1:{}".format(server.server_port)
+
+    writer = IssueWriter("token", api_url=api_url, rate=100, burst=1)
+    try:
+        writer.create_issue("octocat/forbidden", with_marker(dict(title="Forbidden"), "forbidden"))
+    except urllib.error.HTTPError as error:
+        assert error.code == 403 and MockAPIHandler.posts == 1, "plain 403 errors must not be retried"
+    else:
+        raise AssertionError("expected a 403 error")
+
+    for writers in (1, 4, 8):
+        MockAPIHandler.issues.clear()
+        writer = IssueWriter("token", api_url=api_url, rate=100, burst=writers)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            list(
+                executor.map(
+                    lambda n: writer.create_issue(
+                        "octocat/Hello-World", with_marker(dict(title="Issue {}".format(n)), "task-{}".format(n))
+                    ),
+                    range(ISSUES),
+                )
+            )
+        elapsed = time.time() - start
+        bodies = [issue["body"] for issue in writer.list_issues("octocat/Hello-World")]
+        assert len(bodies) == len(set(bodies)) == ISSUES, "expected {} issues created once, got {} ({} unique)".format(
+            ISSUES, len(bodies), len(set(bodies))
+        )
+        print("{} writers: {} issues in {:.1f}s ({:.0f} writes/s)".format(writers, ISSUES, elapsed, ISSUES / elapsed))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
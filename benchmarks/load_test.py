@@ -0,0 +1,52 @@
+"""
+Minimal HTTP load test, to compare gunicorn profiles.
+
+Usage: python benchmarks/load_test.py URL [--concurrency 32] [--requests 2000]
+
+For example, start the application with docker/services/gunicorn/conf.py, then with
+docker/services/gunicorn/production.py, and run against http://localhost:8000/tasks/ each time.
+"""
+
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get(url):
+    start = time.time()
+    try:
+        with urllib.request.urlopen(url) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return status, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(get, [args.url] * args.requests))
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status >= 400)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+    print("{} requests, concurrency {}, {} errors".format(args.requests, args.concurrency, errors))
+    print("throughput  {:.0f} req/s".format(args.requests / elapsed))
+    print("latency     p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms".format(percentile(50), percentile(90), percentile(99)))
+
+
+if __name__ == "__main__":
+    main()
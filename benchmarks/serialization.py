@@ -0,0 +1,117 @@
+"""
+Check that the fast list path returns the same data as the serializers, and compare their speed.
+
+The orjson renderer and the row conversion are first checked against DRF without the database,
+on values of every type found in the responses (aware datetimes, UUIDs...).
+Then it creates 10k tasks in 100 groups if the database has fewer tasks, so run it against a development database.
+
+Usage: DJANGO_SETTINGS_MODULE=core.settings PYTHONPATH=src/taskhub python benchmarks/serialization.py
+"""
+
+import json
+import time
+import uuid
+from datetime import datetime
+
+import django
+
+django.setup()
+
+from core.models import Group, Task, TaskGrouping  # noqa: E402
+from core.renderers import ORJSONRenderer  # noqa: E402
+from core.serializers import GroupSerializer, TaskSerializer, group_rows, task_rows, values_converter  # noqa: E402
+from core.timestamps import UTC  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+TASKS = 10_000
+
+
+def populate():
+    missing = TASKS - Task.objects.count()
+    if missing <= 0:
+        return
+    tasks = Task.objects.bulk_create(Task(title="Task {}".format(i), status="pending") for i in range(missing))
+    groups = Group.objects.bulk_create(Group(title="Group {}".format(i), description="") for i in range(100))
+    TaskGrouping.objects.bulk_create(
+        TaskGrouping(task=task, group=groups[i % len(groups)], order=i) for i, task in enumerate(tasks)
+    )
+
+
+def check_renderers():
+    data = {
+        "datetime": datetime(2020, 1, 2, 3, 4, 5, tzinfo=UTC),
+        "date": datetime(2020, 1, 2).date(),
+        "uuid": uuid.uuid4(),
+        "list": [None, True, 1, 1.5, "text"],
+    }
+    slow = json.loads(JSONRenderer().render(data).decode())
+    fast = json.loads(ORJSONRenderer().render(data).decode())
+    assert slow == fast, "orjson renderer output differs from DRF:\n{}\n{}".format(slow, fast)
+
+
+class DatedTaskSerializer(TaskSerializer):
+    class Meta(TaskSerializer.Meta):
+        fields = TaskSerializer.Meta.fields + ["creation_date", "completion_date", "last_update"]
+
+
+def check_conversion():
+    task = Task(
+        title="Task",
+        description="Description",
+        priority=99,
+        confidential=True,
+        urgency=12.5,
+        recurrence="FREQ=DAILY",
+        version=3,
+        creation_date=datetime(2020, 1, 2, 3, 4, 5, tzinfo=UTC),
+        last_update=datetime(2020, 1, 2, 3, 4, 5, 678, tzinfo=UTC),
+    )
+    for serializer_class in [TaskSerializer, DatedTaskSerializer]:
+        names, convert = values_converter(Task, serializer_class.Meta.fields)
+        row = {name: getattr(task, name) for name in names}
+        slow = json.loads(JSONRenderer().render(serializer_class(task).data).decode())
+        fast = json.loads(ORJSONRenderer().render(convert(row)).decode())
+        assert slow == fast, "row conversion differs from {}:\n{}\n{}".format(serializer_class.__name__, slow, fast)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def sort_key(item):
+    return item["id"]
+
+
+def compare(name, queryset, serializer_class, rows_function):
+    slow, slow_time = timed(lambda: JSONRenderer().render(serializer_class(queryset, many=True).data))
+    fast, fast_time = timed(lambda: ORJSONRenderer().render(rows_function(queryset)))
+
+    slow_data = sorted(json.loads(slow.decode()), key=sort_key)
+    fast_data = sorted(json.loads(fast.decode()), key=sort_key)
+    for data in (slow_data, fast_data):
+        for item in data:
+            if "tasks" in item:
+                item["tasks"].sort(key=sort_key)
+                item["labels"].sort(key=sort_key)
+    assert slow_data == fast_data, "{}: fast path data differs from the serializer data".format(name)
+
+    print(
+        "{:<6} serializer + json {:>8.3f}s   values + orjson {:>8.3f}s   {:.1f}x".format(
+            name, slow_time, fast_time, slow_time / fast_time
+        )
+    )
+
+
+def main():
+    check_renderers()
+    check_conversion()
+    print("orjson renderer and row conversion match DRF")
+    populate()
+    compare("tasks", Task.objects.all()[:TASKS], TaskSerializer, task_rows)
+    compare("groups", Group.objects.all(), GroupSerializer, group_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of the timestamp codec.
+
+Usage: PYTHONPATH=src python benchmarks/timestamps.py
+"""
+
+import random
+import timeit
+from datetime import datetime
+
+from taskhub.core.timestamps import TW_FORMAT, parse_column, parse_tw
+
+NUMBER = 100_000
+
+
+def str_to_date(d):
+    # previous implementation, kept as the baseline
+    return datetime(
+        year=int(d[:4]), month=int(d[4:6]), day=int(d[6:8]), hour=int(d[9:11]), minute=int(d[11:13]), second=int(d[13:15])
+    )
+
+
+def main():
+    value = "20190102T030405Z"
+    # a column of 100k timestamps spread over ~8k distinct values
+    column = [
+        "2019{:02d}{:02d}T{:02d}0000Z".format(random.randint(1, 12), random.randint(1, 28), random.randint(0, 23))
+        for _ in range(NUMBER)
+    ]
+
+    results = [
+        ("baseline (keyword args)", timeit.timeit(lambda: str_to_date(value), number=NUMBER)),
+        ("datetime.strptime", timeit.timeit(lambda: datetime.strptime(value, TW_FORMAT), number=NUMBER)),
+        ("parse_tw", timeit.timeit(lambda: parse_tw(value), number=NUMBER)),
+        ("parse_column (per item)", timeit.timeit(lambda: parse_column(column), number=1)),
+    ]
+
+    for name, seconds in results:
+        print("{:<25} {:>8.3f} us/timestamp".format(name, seconds / NUMBER * 1_000_000))
+
+
+if __name__ == "__main__":
+    main()
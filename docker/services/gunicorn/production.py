@@ -0,0 +1,30 @@
+# Production profile: threaded workers sharing the preloaded application.
+# Usage: gunicorn -c docker/services/gunicorn/production.py ...
+# Each thread keeps its own persistent database connection (see CONN_MAX_AGE in core.settings),
+# so the number of connections is bounded by workers * threads.
+import multiprocessing
+import os
+
+name = 'taskhub'
+loglevel = 'info'
+errorlog = '-'
+accesslog = '-'
+
+cpu_count = multiprocessing.cpu_count()
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', cpu_count + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+keepalive = 5
+
+# load the application once in the master process, and share its memory with the workers
+preload_app = True
+# recycle workers from time to time, to contain memory leaks
+max_requests = 2000
+max_requests_jitter = 200
+
+
+def post_fork(server, worker):
+    # never share database connections opened while preloading the application with the workers
+    from django.db import connections
+
+    connections.close_all()
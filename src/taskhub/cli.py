@@ -17,28 +17,77 @@ Why does this file exist, and why not put this in __main__?
 
 import argparse
 
-from .core import services
+from .core.journal import DEFAULT_PATH, Journal, NullJournal
+from .core.services.multi import sync
 
 
 def get_parser():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-i", "--input-service", dest="input_service", default="stdin")
+    parser.add_argument(
+        "-i",
+        "--input-service",
+        dest="input_services",
+        action="append",
+        help="Service to read tasks from. Repeat to read from several services concurrently. Default: stdin.",
+    )
     parser.add_argument("-o", "--output-service", dest="output_service", default="stdout")
 
-    parser.add_argument("-s", "--srv-opt", "--service-option", dest="services_options", nargs=1)
+    parser.add_argument(
+        "-s",
+        "--srv-opt",
+        "--service-option",
+        dest="services_options",
+        action="append",
+        default=[],
+        help="Option passed to a service, as SERVICE.OPTION=VALUE, for example github.users=pawamoy. Can be repeated.",
+    )
+
+    parser.add_argument(
+        "-j", "--journal", dest="journal", default=DEFAULT_PATH, help="Path to the journal used to resume runs."
+    )
+    parser.add_argument("--no-journal", dest="journal", action="store_const", const=None, help="Disable the journal.")
+    parser.add_argument(
+        "--restart", dest="restart", action="store_true", help="Start a new run instead of resuming an interrupted one."
+    )
 
     return parser
 
 
+def parse_option_value(value):
+    # booleans and integers are coerced, so that copy=false is falsy for example
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parse_services_options(options):
+    services_options = {}
+    for option in options:
+        name, value = option.split("=", 1)
+        service, name = name.split(".", 1)
+        services_options.setdefault(service, {})[name] = parse_option_value(value)
+    return services_options
+
+
 def main(args=None):
     parser = get_parser()
     args = parser.parse_args(args=args)
 
-    input_service = services.SERVICES[args.input_service]
-    output_service = services.SERVICES[args.output_service]
+    input_services_names = args.input_services or ["stdin"]
+    services_options = parse_services_options(args.services_options)
+
+    if args.journal:
+        journal_name = "{}-{}".format("+".join(input_services_names), args.output_service)
+        journal = Journal(journal_name, args.journal, args.restart)
+    else:
+        journal = NullJournal()
+
+    sync(input_services_names, args.output_service, services_options, journal)
 
-    data = input_service.read_tasks()
-    output_service.write_tasks(data)
+    journal.finish()
 
     return 0
@@ -1,96 +1,199 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
-from .models import Group, GroupGrouping, GroupRel, Label, Rel, Task, TaskGrouping, TaskGroupRel, TaskRef, TaskRel
+from .models import (
+    ArchivedTask,
+    Group,
+    GroupGrouping,
+    GroupRel,
+    Label,
+    Rel,
+    SyncJob,
+    Task,
+    TaskGrouping,
+    TaskGroupRel,
+    TaskRef,
+    TaskRel,
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator using the row estimate of the query planner instead of ``COUNT(*)``, which scans the whole table.
+
+    Small results (estimated below ``exact_below`` rows) are still counted exactly.
+    """
+
+    exact_below = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            estimate = cursor.fetchone()[0][0]["Plan"]["Plan Rows"]
+        if estimate < self.exact_below:
+            return super().count
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Admin for tables with millions of rows: estimated counts, and no full count next to filtered counts."""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """An inline formset showing one page of related objects, selected with the ``<prefix>-page`` query parameter."""
+
+    per_page = 20
+    query_params = {}
+
+    def get_queryset(self):
+        if not hasattr(self, "_queryset"):
+            queryset = super().get_queryset()
+            if not queryset.ordered:
+                queryset = queryset.order_by("pk")
+            self.page = Paginator(queryset, self.per_page).get_page(self.query_params.get(self.prefix + "-page"))
+            self._queryset = self.page.object_list
+        return self._queryset
+
+
+class PaginatedInline(admin.TabularInline):
+    formset = PaginatedInlineFormSet
+    template = "admin/core/paginated_tabular.html"
+    extra = 0
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.query_params = request.GET
+        return formset
 
 
-class TasksInGroupInline(admin.TabularInline):
+class TasksInGroupInline(PaginatedInline):
     model = Group.tasks.through
-    extra = 0
+    autocomplete_fields = ("task",)
     verbose_name = _("Task")
     verbose_name_plural = _("Tasks in this group")
 
 
-class GroupsContainingTaskInline(admin.TabularInline):
+class GroupsContainingTaskInline(PaginatedInline):
     model = Group.tasks.through
-    extra = 0
+    autocomplete_fields = ("group",)
     verbose_name = _("Group")
     verbose_name_plural = _("Groups containing this task")
 
 
-class GroupsContainingGroupInline(admin.TabularInline):
+class GroupsContainingGroupInline(PaginatedInline):
     model = Group.groups.through
     fk_name = "group"
-    extra = 0
+    autocomplete_fields = ("in_group",)
     verbose_name = _("Group")
     verbose_name_plural = _("Groups containing this group")
 
 
-class GroupsContainedByGroupInline(admin.TabularInline):
+class GroupsContainedByGroupInline(PaginatedInline):
     model = Group.groups.through
     fk_name = "in_group"
-    extra = 0
+    autocomplete_fields = ("group",)
     verbose_name = _("Group")
     verbose_name_plural = _("Groups contained by this group")
 
 
-class GroupLabelsInline(admin.TabularInline):
+class GroupLabelsInline(PaginatedInline):
     model = Group.labels.through
-    extra = 0
+    autocomplete_fields = ("label",)
     verbose_name = _("Label")
     verbose_name_plural = _("Group's labels")
 
 
-class TaskLabelsInline(admin.TabularInline):
+class TaskLabelsInline(PaginatedInline):
     model = Task.labels.through
-    extra = 0
+    autocomplete_fields = ("label",)
     verbose_name = _("Label")
     verbose_name_plural = _("Task's labels")
 
 
-class LabelGroupsInline(admin.TabularInline):
+class LabelGroupsInline(PaginatedInline):
     model = Group.labels.through
-    extra = 0
+    autocomplete_fields = ("group",)
     verbose_name = _("Group")
     verbose_name_plural = _("Groups with this label")
 
 
-class LabelTasksInline(admin.TabularInline):
+class LabelTasksInline(PaginatedInline):
     model = Task.labels.through
-    extra = 0
+    autocomplete_fields = ("task",)
     verbose_name = _("Task")
     verbose_name_plural = _("Tasks with this label")
 
 
+@admin.register(ArchivedTask)
+class ArchivedTaskAdmin(LargeTableAdmin):
+    list_display = ("id", "title", "status", "completion_date", "archive_date")
+    date_hierarchy = "completion_date"
+    # prefix searches use an index, see core.search
+    search_fields = ("^title",)
+
+
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
     inlines = (TasksInGroupInline, GroupsContainedByGroupInline, GroupsContainingGroupInline)
     list_display = ("id", "title", "description")
+    search_fields = ("title",)
+    autocomplete_fields = ("labels",)
 
 
 @admin.register(GroupGrouping)
-class GroupGroupingAdmin(admin.ModelAdmin):
+class GroupGroupingAdmin(LargeTableAdmin):
     list_display = ("group", "in_group", "order")
+    list_select_related = ("group", "in_group")
+    autocomplete_fields = ("group", "in_group")
 
 
 @admin.register(GroupRel)
-class GroupRelAdmin(admin.ModelAdmin):
+class GroupRelAdmin(LargeTableAdmin):
     list_display = ("from_group", "rel", "to_group")
+    list_select_related = ("from_group", "rel", "to_group")
+    autocomplete_fields = ("from_group", "rel", "to_group")
 
 
 @admin.register(Label)
 class LabelAdmin(admin.ModelAdmin):
     inlines = (LabelTasksInline, LabelGroupsInline)
     list_display = ("title", "description", "color")
+    search_fields = ("title",)
 
 
 @admin.register(Rel)
 class RelAdmin(admin.ModelAdmin):
     list_display = ("title", "description")
+    search_fields = ("title",)
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "input_services",
+        "output_service",
+        "status",
+        "progress",
+        "attempts",
+        "creation_date",
+        "end_date",
+    )
+    list_filter = ("status",)
 
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(LargeTableAdmin):
     inlines = (GroupsContainingTaskInline, TaskLabelsInline)
     list_display = (
         "id",
@@ -102,23 +205,35 @@ class TaskAdmin(admin.ModelAdmin):
         "priority",
         "confidential",
     )
+    # prefix searches use an index, see core.search
+    search_fields = ("^title",)
+    autocomplete_fields = ("labels", "recurrence_parent")
 
 
 @admin.register(TaskGrouping)
-class TaskGroupingAdmin(admin.ModelAdmin):
+class TaskGroupingAdmin(LargeTableAdmin):
     list_display = ("task", "group", "order")
+    list_select_related = ("task", "group")
+    autocomplete_fields = ("task", "group")
 
 
 @admin.register(TaskGroupRel)
-class TaskGroupRelAdmin(admin.ModelAdmin):
+class TaskGroupRelAdmin(LargeTableAdmin):
     list_display = ("task", "rel", "group")
+    list_select_related = ("task", "rel", "group")
+    autocomplete_fields = ("task", "rel", "group")
 
 
 @admin.register(TaskRef)
-class TaskRefAdmin(admin.ModelAdmin):
+class TaskRefAdmin(LargeTableAdmin):
     list_display = ("task", "ref")
+    list_select_related = ("task",)
+    autocomplete_fields = ("task",)
+    search_fields = ("=ref",)
 
 
 @admin.register(TaskRel)
-class TaskRelAdmin(admin.ModelAdmin):
+class TaskRelAdmin(LargeTableAdmin):
     list_display = ("task1", "rel", "task2")
+    list_select_related = ("task1", "rel", "task2")
+    autocomplete_fields = ("task1", "rel", "task2")
@@ -0,0 +1,32 @@
+from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_migrate, post_save
+
+
+class CoreConfig(AppConfig):
+    name = "core"
+
+    def ready(self):
+        from . import graph, urgency
+        from .board import invalidate_board
+        from .extra import create_indexes_after_migrate
+        from .models import Group, Task, TaskGrouping, TaskRel
+        from .search import create_search_indexes_after_migrate
+
+        for model in (Task, Group, TaskGrouping):
+            post_save.connect(invalidate_board, sender=model, dispatch_uid="invalidate_board")
+            post_delete.connect(invalidate_board, sender=model, dispatch_uid="invalidate_board")
+        m2m_changed.connect(invalidate_board, sender=Group.tasks.through, dispatch_uid="invalidate_board")
+
+        post_init.connect(graph.task_initialized, sender=Task, dispatch_uid="graph_task_initialized")
+        post_save.connect(graph.task_saved, sender=Task, dispatch_uid="graph_task_saved")
+        post_delete.connect(graph.task_deleted, sender=Task, dispatch_uid="graph_task_deleted")
+        post_save.connect(graph.task_rel_saved, sender=TaskRel, dispatch_uid="graph_task_rel_saved")
+        post_delete.connect(graph.task_rel_deleted, sender=TaskRel, dispatch_uid="graph_task_rel_deleted")
+
+        post_save.connect(urgency.task_saved, sender=Task, dispatch_uid="urgency_task_saved")
+        m2m_changed.connect(urgency.task_labels_changed, sender=Task.labels.through, dispatch_uid="urgency_labels")
+        post_save.connect(urgency.task_rel_changed, sender=TaskRel, dispatch_uid="urgency_task_rel_saved")
+        post_delete.connect(urgency.task_rel_changed, sender=TaskRel, dispatch_uid="urgency_task_rel_deleted")
+
+        post_migrate.connect(create_indexes_after_migrate, sender=self, dispatch_uid="extra_indexes")
+        post_migrate.connect(create_search_indexes_after_migrate, sender=self, dispatch_uid="search_indexes")
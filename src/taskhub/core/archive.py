@@ -0,0 +1,134 @@
+"""
+Archive of completed tasks.
+
+Completed tasks are moved out of the task table into ``ArchivedTask`` rows by ``manage.py archive_tasks``,
+some days after their completion. The task table then only holds the hot data, so the boards, lists and indexes
+don't grow with the history. Archived tasks keep a snapshot of their fields, labels, groupings and relationships,
+and can be restored. Their references in the services are kept too, so syncs don't import them again.
+
+Occurrences of recurring tasks are not archived: the generated occurrence would replace them.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .graph import invalidate_graph
+from .models import ArchivedTask, Group, Label, Task, TaskGrouping, TaskGroupRel, TaskRef, TaskRel
+
+TASK_FIELDS = [field.attname for field in Task._meta.concrete_fields]
+
+
+def snapshot(task_ids):
+    """Return unsaved ``ArchivedTask`` instances for the given tasks."""
+    archives = {}
+    for row in Task.objects.filter(pk__in=task_ids).values(*TASK_FIELDS):
+        archives[row["id"]] = ArchivedTask(
+            id=row["id"],
+            title=row["title"],
+            status=row["status"],
+            completion_date=row["completion_date"],
+            data={"fields": row, "labels": [], "groupings": [], "rels": [], "group_rels": []},
+        )
+
+    def add(key, task_id, value):
+        archives[task_id].data[key].append(value)
+
+    for task_id, label_id in Task.labels.through.objects.filter(task_id__in=task_ids).values_list(
+        "task_id", "label_id"
+    ):
+        add("labels", task_id, label_id)
+    for task_id, group_id, order in TaskGrouping.objects.filter(task_id__in=task_ids).values_list(
+        "task_id", "group_id", "order"
+    ):
+        add("groupings", task_id, [group_id, order])
+    for task_id, group_id, rel_id in TaskGroupRel.objects.filter(task_id__in=task_ids).values_list(
+        "task_id", "group_id", "rel_id"
+    ):
+        add("group_rels", task_id, [group_id, rel_id])
+    for task1_id, task2_id, rel_id in TaskRel.objects.filter(
+        Q(task1_id__in=task_ids) | Q(task2_id__in=task_ids)
+    ).values_list("task1_id", "task2_id", "rel_id"):
+        for task_id in {task1_id, task2_id} & archives.keys():
+            add("rels", task_id, [task1_id, task2_id, rel_id])
+    for task_id, ref in TaskRef.objects.filter(task_id__in=task_ids).values_list("task_id", "ref"):
+        archives[task_id].refs.append(ref)
+
+    return list(archives.values())
+
+
+def archive_tasks(older_than=timedelta(days=30), batch_size=1000, progress=True):
+    """
+    Move the tasks completed before a delay into the archive.
+
+    Batches are locked with ``SKIP LOCKED``, so tasks being edited are left for the next run.
+
+    Returns:
+        The number of archived tasks.
+    """
+    candidates = Task.objects.filter(
+        completion_date__lt=timezone.now() - older_than, recurrence="", recurrence_parent__isnull=True
+    )
+    archived = 0
+    while True:
+        with transaction.atomic():
+            task_ids = list(candidates.select_for_update(skip_locked=True).values_list("pk", flat=True)[:batch_size])
+            if not task_ids:
+                break
+            ArchivedTask.objects.bulk_create(snapshot(task_ids))
+            # cascades to the references, groupings and relationships
+            Task.objects.filter(pk__in=task_ids).delete()
+        archived += len(task_ids)
+        if progress:
+            print("Archived {} tasks".format(archived))
+    return archived
+
+
+def restore_task(archived):
+    """
+    Move an archived task back into the task table.
+
+    Its labels, groupings and relationships are restored when the other side still exists.
+    """
+    data = archived.data
+    fields = {name: Task._meta.get_field(name).to_python(value) for name, value in data["fields"].items()}
+    parent_id = fields.get("recurrence_parent_id")
+    if parent_id and not Task.objects.filter(pk=parent_id).exists():
+        fields["recurrence_parent_id"] = None
+
+    with transaction.atomic():
+        task = Task.objects.create(**fields)
+
+        labels = Label.objects.filter(pk__in=data["labels"]).values_list("pk", flat=True)
+        task.labels.add(*labels)
+
+        # ids went through JSON: they are strings
+        group_ids = {group_id for group_id, _ in data["groupings"] + data["group_rels"]}
+        groups = {str(pk) for pk in Group.objects.filter(pk__in=group_ids).values_list("pk", flat=True)}
+        TaskGrouping.objects.bulk_create(
+            TaskGrouping(task=task, group_id=group_id, order=order)
+            for group_id, order in data["groupings"]
+            if group_id in groups
+        )
+        TaskGroupRel.objects.bulk_create(
+            TaskGroupRel(task=task, group_id=group_id, rel_id=rel_id)
+            for group_id, rel_id in data["group_rels"]
+            if group_id in groups
+        )
+
+        task_ids = {task_id for task1_id, task2_id, _ in data["rels"] for task_id in (task1_id, task2_id)}
+        tasks = {str(pk) for pk in Task.objects.filter(pk__in=task_ids).values_list("pk", flat=True)}
+        TaskRel.objects.bulk_create(
+            TaskRel(task1_id=task1_id, task2_id=task2_id, rel_id=rel_id)
+            for task1_id, task2_id, rel_id in data["rels"]
+            if task1_id in tasks and task2_id in tasks
+        )
+        if data["rels"]:
+            # bulk creations don't send signals
+            invalidate_graph()
+
+        TaskRef.objects.bulk_create([TaskRef(task=task, ref=ref) for ref in archived.refs], ignore_conflicts=True)
+        archived.delete()
+    return task
@@ -0,0 +1,91 @@
+"""
+Kanban board: per-status and per-group counts, and the first tasks of each status column.
+
+The whole board is computed in one SQL round trip: ``ROW_NUMBER() OVER (PARTITION BY status ...)``
+ranks the tasks inside their column, and the per-group counts are appended with ``UNION ALL``.
+Boards are cached, and the cache is invalidated by bumping a generation number whenever tasks change
+(see ``invalidate_board``, connected to the model signals in ``core.apps``, and ``core.generations``).
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router, transaction
+
+from .generations import bump_generation, get_generation
+from .models import Group, Task, TaskGrouping
+
+GENERATION = "board"
+
+BOARD_SQL = """
+WITH ranked AS (
+    SELECT
+        id, title, status, priority, manual_order, due_date,
+        ROW_NUMBER() OVER (PARTITION BY status ORDER BY manual_order, id) AS rank,
+        COUNT(*) OVER (PARTITION BY status) AS count
+    FROM {task}
+)
+SELECT 'task', status, NULL, count, id, title, priority, manual_order, due_date
+FROM ranked WHERE rank <= %s
+UNION ALL
+SELECT 'group', t.status, g.id, COUNT(*), NULL, g.title, NULL, NULL, NULL
+FROM {grouping} tg JOIN {task} t ON t.id = tg.task_id JOIN {group} g ON g.id = tg.group_id
+GROUP BY g.id, g.title, t.status
+"""
+
+
+def invalidate_board(*args, **kwargs):
+    """Invalidate the cached boards once the current transaction is committed (usable as a signal receiver)."""
+    transaction.on_commit(lambda: bump_generation(GENERATION))
+
+
+def compute_board(limit):
+    sql = BOARD_SQL.format(
+        task=Task._meta.db_table, grouping=TaskGrouping._meta.db_table, group=Group._meta.db_table
+    )
+    columns = {}
+    groups = {}
+    # the board is cached under the generation read on the primary: a lagging replica could cache stale rows
+    with connections[router.db_for_write(Task)].cursor() as cursor:
+        cursor.execute(sql, [limit])
+        for kind, status, group_id, count, task_id, title, priority, manual_order, due_date in cursor.fetchall():
+            if kind == "task":
+                column = columns.setdefault(status, {"status": status, "count": count, "tasks": []})
+                column["tasks"].append(
+                    {
+                        "id": task_id,
+                        "title": title,
+                        "priority": priority,
+                        "manual_order": manual_order,
+                        "due_date": due_date,
+                    }
+                )
+            else:
+                group = groups.setdefault(group_id, {"id": group_id, "title": title, "count": 0, "statuses": {}})
+                group["count"] += count
+                group["statuses"][status] = count
+
+    # rows come out of the UNION in no particular order
+    for column in columns.values():
+        column["tasks"].sort(key=lambda task: (task["manual_order"], str(task["id"])))
+    return {
+        "columns": sorted(columns.values(), key=lambda column: column["status"]),
+        "groups": sorted(groups.values(), key=lambda group: group["title"]),
+    }
+
+
+def get_board(limit):
+    """
+    Return the board, from the cache when it is up-to-date.
+
+    Arguments:
+        limit: The maximum number of tasks returned per status column.
+
+    Returns:
+        A dictionary with ``columns`` (status, count, first tasks) and ``groups`` (count per status).
+    """
+    key = "taskhub:board:{}:{}".format(get_generation(GENERATION), limit)
+    board = cache.get(key)
+    if board is None:
+        board = compute_board(limit)
+        cache.set(key, board, settings.BOARD_CACHE_TIMEOUT)
+    return board
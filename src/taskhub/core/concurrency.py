@@ -0,0 +1,66 @@
+"""
+Optimistic concurrency for bulk writes.
+
+Single objects are saved conditionally by ``models.Versioned``. For bulk writes, ``bulk_update_versioned``
+does the same for many rows in one statement: each row is only updated if it is still at the version
+read by the writer, and the rows left out are reported as conflicts, to be retried or skipped by the caller.
+No rows are locked while the new values are computed.
+"""
+
+from django.db import connections
+
+
+def bulk_update_versioned(model, objs, fields, versions, batch_size=1000, using="default"):
+    """
+    Update the given fields of objects in bulk, only where their row is still at the expected version.
+
+    Updated rows have their version incremented. Like ``bulk_update``, this sends no signals.
+
+    Arguments:
+        model: A ``models.Versioned`` model.
+        objs: The objects to update.
+        fields: The names of the fields to update.
+        versions: The expected versions, by primary key.
+        batch_size: The number of rows updated per statement.
+        using: The database alias.
+
+    Returns:
+        The set of the primary keys of the objects that were not updated.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    meta = model._meta
+    pk_field, version_field = meta.pk, meta.get_field("version")
+    fields = [meta.get_field(name) for name in fields]
+
+    # VALUES rows are untyped: cast each parameter to the type of its column
+    row = "({})".format(
+        ", ".join("%s::{}".format(field.db_type(connection)) for field in [pk_field, version_field] + fields)
+    )
+    sql = (
+        "UPDATE {table} t SET {sets}, {version} = t.{version} + 1 "
+        "FROM (VALUES {{rows}}) AS v ({pk}, expected_version, {columns}) "
+        "WHERE t.{pk} = v.{pk} AND t.{version} = v.expected_version "
+        "RETURNING t.{pk}"
+    ).format(
+        table=quote(meta.db_table),
+        sets=", ".join("{0} = v.{0}".format(quote(field.column)) for field in fields),
+        version=quote(version_field.column),
+        pk=quote(pk_field.column),
+        columns=", ".join(quote(field.column) for field in fields),
+    )
+
+    conflicts = set()
+    objs = list(objs)
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start : start + batch_size]
+            params = []
+            for obj in batch:
+                params.append(pk_field.get_db_prep_value(obj.pk, connection))
+                params.append(versions[obj.pk])
+                params.extend(field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields)
+            cursor.execute(sql.format(rows=", ".join([row] * len(batch))), params)
+            updated = {pk_field.to_python(pk) for pk, in cursor.fetchall()}
+            conflicts.update(obj.pk for obj in batch if pk_field.to_python(obj.pk) not in updated)
+    return conflicts
@@ -0,0 +1,106 @@
+"""
+Indexes on the hot keys of ``Task.extra``.
+
+Services store their own data in the ``extra`` JSON field (a GitHub URL, a project...). Looking tasks up
+on such a key decodes the JSON of every row, unless the key has an expression index. The ``TASK_EXTRA_INDEXES``
+setting declares the hot keys and their type, and this module maintains one B-tree index per key on
+``extra -> 'key'``: the very expression used by the ORM for ``Task.objects.filter(extra__key=value)``,
+so these lookups (and the ``extra__key`` API filters) become index scans.
+
+The indexes are created and dropped after each ``migrate`` to match the setting, or with
+``manage.py sync_extra_indexes --concurrently`` to avoid locking a big table.
+"""
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Task
+
+INDEX_PREFIX = "core_task_extra_"
+
+
+def parse_boolean(value):
+    if value.lower() not in ("0", "1", "false", "true"):
+        raise ValueError("not a boolean: {}".format(value))
+    return value.lower() in ("1", "true")
+
+
+# parsers of query parameters, raising ValueError (JSON numbers compare numerically: 5.0 matches 5)
+TYPES = {"string": str, "number": float, "boolean": parse_boolean}
+
+
+def get_hot_keys():
+    """Return the hot keys of ``Task.extra`` with their type (see ``TYPES``)."""
+    keys = getattr(settings, "TASK_EXTRA_INDEXES", {})
+    for key, type_name in keys.items():
+        if type_name not in TYPES:
+            raise ValueError("TASK_EXTRA_INDEXES: type of {} must be one of {}".format(key, ", ".join(TYPES)))
+    return keys
+
+
+def index_name(key):
+    # identifiers are limited to 63 characters, the hash keeps the names of similar keys distinct
+    return "{}{}_{}".format(INDEX_PREFIX, re.sub(r"\W", "_", key)[:30], hashlib.md5(key.encode()).hexdigest()[:8])
+
+
+def sync_extra_indexes(using="default", concurrently=False):
+    """
+    Create the missing indexes of hot keys, and drop the indexes of keys that are not hot anymore.
+
+    Arguments:
+        using: The database alias.
+        concurrently: Whether to build and drop the indexes without locking the table against writes.
+            This cannot run inside a transaction.
+
+    Returns:
+        The lists of created and dropped index names.
+    """
+    table = Task._meta.db_table
+    wanted = {index_name(key): key for key in get_hot_keys()}
+    concurrently = "CONCURRENTLY " if concurrently else ""
+
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [table])
+        existing = {name for name, in cursor.fetchall() if name.startswith(INDEX_PREFIX)}
+
+        created = sorted(wanted.keys() - existing)
+        for name in created:
+            cursor.execute(
+                'CREATE INDEX {}IF NOT EXISTS "{}" ON "{}" ((extra -> %s))'.format(concurrently, name, table),
+                [wanted[name]],
+            )
+
+        dropped = sorted(existing - wanted.keys())
+        for name in dropped:
+            cursor.execute('DROP INDEX {}IF EXISTS "{}"'.format(concurrently, name))
+
+    return created, dropped
+
+
+def create_indexes_after_migrate(sender, using="default", verbosity=1, **kwargs):
+    if connections[using].vendor != "postgresql":
+        return
+    created, dropped = sync_extra_indexes(using)
+    if verbosity:
+        for name in created:
+            print("  Created index {}".format(name))
+        for name in dropped:
+            print("  Dropped index {}".format(name))
+
+
+def extra_filters(params):
+    """
+    Return the ORM filters on hot keys found in query parameters (``extra__key=value``).
+
+    Raises:
+        ValueError: When a value does not match the type of its key.
+    """
+    filters = {}
+    for key, type_name in get_hot_keys().items():
+        value = params.get("extra__" + key)
+        if value is not None:
+            filters["extra__" + key] = TYPES[type_name](value)
+    return filters
@@ -0,0 +1,31 @@
+"""
+Generation numbers of cached data (boards, dependency graphs).
+
+A generation is bumped whenever the data it covers changes, and caches are keyed by it. Generations are
+stored in the database rather than in the cache: every process sees the bumps of the others, whatever
+the cache backend, and a per-process cache (``LocMemCache``) is only less shared, never stale.
+They are always read from the primary database, as replicas may not have the latest bumps yet.
+"""
+
+from django.db import connections, router
+
+from .models import Generation
+
+
+def get_generation(name):
+    """Return the current generation of some cached data (0 if it never changed)."""
+    using = router.db_for_write(Generation)
+    return Generation.objects.using(using).filter(name=name).values_list("value", flat=True).first() or 0
+
+
+def bump_generation(name):
+    """Increment the generation of some cached data, and return the new one."""
+    connection = connections[router.db_for_write(Generation)]
+    table = connection.ops.quote_name(Generation._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {0} (name, value) VALUES (%s, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = {0}.value + 1 RETURNING value".format(table),
+            [name],
+        )
+        return cursor.fetchone()[0]
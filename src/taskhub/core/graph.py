@@ -0,0 +1,424 @@
+"""
+In-memory index of the dependencies between tasks (see ``TaskRel``).
+
+Task ids are interned into small integers, and each task has compact arrays of its predecessors
+(the tasks blocking it) and successors (the tasks it blocks). The index is loaded in bulk with two queries,
+then kept up-to-date incrementally from the ``TaskRel`` and ``Task`` signals (see ``core.apps``).
+
+Each process has its own index. A generation number stored in the database (see ``core.generations``)
+tells a process when another one changed the dependencies: its index is then reloaded on the next access.
+
+The index returned by ``get_graph`` is a snapshot that is never changed, so it can be queried without locks:
+changes are applied to a copy, which then replaces it, and reloads build a new index.
+
+A task is done when it has a completion date. Which relationships are dependencies is configured
+with the ``DEPENDENCY_RELS`` setting.
+"""
+
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import router, transaction
+
+from .generations import bump_generation, get_generation
+from .models import Rel, Task, TaskRel
+
+GENERATION = "graph"
+
+# the task fields kept in the graph: saving a task that changes none of them leaves the graph alone
+TASK_FIELDS = ("completion_date", "min_duration", "max_duration")
+
+
+class DependencyGraph:
+    def __init__(self):
+        self.ids = []
+        self.index = {}
+        self.predecessors = []
+        self.successors = []
+        self.done = bytearray()
+        self.alive = bytearray()
+        self.min_durations = array("d")
+        self.max_durations = array("d")
+        # results of the queries, cleared on every change
+        self.results = {}
+        self.generation = None
+
+    def intern(self, task_id):
+        """Return the integer of a task id, allocating it if needed."""
+        i = self.index.get(task_id)
+        if i is None:
+            i = self.index[task_id] = len(self.ids)
+            self.ids.append(task_id)
+            self.predecessors.append(array("l"))
+            self.successors.append(array("l"))
+            self.done.append(0)
+            self.alive.append(1)
+            self.min_durations.append(0)
+            self.max_durations.append(0)
+        return i
+
+    def copy(self):
+        """
+        Return a copy of the graph, to change it while this one is still queried.
+
+        The arrays of predecessors and successors of each task are shared: changes replace them instead of
+        changing them in place.
+        """
+        graph = DependencyGraph()
+        graph.ids = list(self.ids)
+        graph.index = dict(self.index)
+        graph.predecessors = list(self.predecessors)
+        graph.successors = list(self.successors)
+        graph.done = bytearray(self.done)
+        graph.alive = bytearray(self.alive)
+        graph.min_durations = array("d", self.min_durations)
+        graph.max_durations = array("d", self.max_durations)
+        graph.generation = self.generation
+        return graph
+
+    def load(self):
+        blocks, depends_on = settings.DEPENDENCY_RELS["blocks"], settings.DEPENDENCY_RELS["depends_on"]
+        # from the primary database, as the generation: replicas may not have the latest changes yet
+        using = router.db_for_write(Task)
+        self.__init__()
+        for task_id, completion_date, min_duration, max_duration in (
+            Task.objects.using(using).values_list("id", "completion_date", "min_duration", "max_duration").iterator()
+        ):
+            self.set_task(task_id, completion_date, min_duration, max_duration)
+        for task1_id, task2_id, rel_title in (
+            TaskRel.objects.using(using)
+            .filter(rel__title__in=blocks + depends_on)
+            .values_list("task1_id", "task2_id", "rel__title")
+        ):
+            blocking_id, blocked_id = (task1_id, task2_id) if rel_title in blocks else (task2_id, task1_id)
+            # the graph being loaded is not shared yet: its arrays are extended in place
+            i, j = self.intern(blocking_id), self.intern(blocked_id)
+            self.successors[i].append(j)
+            self.predecessors[j].append(i)
+
+    def changed(self):
+        self.results.clear()
+
+    def set_task(self, task_id, completion_date, min_duration, max_duration):
+        i = self.intern(task_id)
+        self.alive[i] = 1
+        self.done[i] = completion_date is not None
+        self.min_durations[i] = min_duration.total_seconds() if min_duration else 0
+        self.max_durations[i] = max_duration.total_seconds() if max_duration else 0
+        self.changed()
+
+    def remove_task(self, task_id):
+        i = self.index.get(task_id)
+        if i is None:
+            return
+        for j in self.successors[i]:
+            self.predecessors[j] = without(self.predecessors[j], i)
+        for j in self.predecessors[i]:
+            self.successors[j] = without(self.successors[j], i)
+        self.successors[i] = array("l")
+        self.predecessors[i] = array("l")
+        self.alive[i] = 0
+        self.changed()
+
+    def add_edge(self, blocking_id, blocked_id):
+        i, j = self.intern(blocking_id), self.intern(blocked_id)
+        self.successors[i] = self.successors[i] + array("l", [j])
+        self.predecessors[j] = self.predecessors[j] + array("l", [i])
+        self.changed()
+
+    def remove_edge(self, blocking_id, blocked_id):
+        i, j = self.index.get(blocking_id), self.index.get(blocked_id)
+        if i is not None and j is not None and j in self.successors[i]:
+            self.successors[i] = without(self.successors[i], j)
+            self.predecessors[j] = without(self.predecessors[j], i)
+            self.changed()
+
+    def neighbors(self, task_id):
+        """Return the ids of the tasks blocking a task and of the tasks it blocks."""
+        i = self.index.get(task_id)
+        if i is None:
+            return []
+        return [self.ids[j] for j in self.predecessors[i] + self.successors[i]]
+
+    def cached(self, key, compute):
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+    def _blocked(self):
+        done, alive = self.done, self.alive
+        return [
+            self.ids[i]
+            for i, predecessors in enumerate(self.predecessors)
+            if predecessors and alive[i] and not done[i] and any(not done[j] for j in predecessors)
+        ]
+
+    def blocked(self):
+        """Return the ids of the pending tasks that wait for at least one pending task."""
+        return self.cached("blocked", self._blocked)
+
+    def _unblocked(self):
+        done, alive = self.done, self.alive
+        return [
+            self.ids[i]
+            for i, predecessors in enumerate(self.predecessors)
+            if predecessors and alive[i] and not done[i] and all(done[j] for j in predecessors)
+        ]
+
+    def unblocked(self):
+        """Return the ids of the pending tasks that have dependencies, all of them done."""
+        return self.cached("unblocked", self._unblocked)
+
+    def _blocking(self):
+        done, alive = self.done, self.alive
+        return [
+            self.ids[i]
+            for i, successors in enumerate(self.successors)
+            if successors and alive[i] and not done[i] and any(not done[j] for j in successors)
+        ]
+
+    def blocking(self):
+        """Return the ids of the pending tasks that other pending tasks wait for."""
+        return self.cached("blocking", self._blocking)
+
+    def flags(self, task_ids):
+        """
+        Tell which of some tasks are blocked and which are blocking, from their own dependencies only.
+
+        Returns:
+            The ids of the tasks that are in ``blocked()``, and the ids of the ones that are in ``blocking()``.
+        """
+        done, alive = self.done, self.alive
+        blocked, blocking = set(), set()
+        for task_id in task_ids:
+            i = self.index.get(task_id)
+            if i is None or not alive[i] or done[i]:
+                continue
+            if any(not done[j] for j in self.predecessors[i]):
+                blocked.add(task_id)
+            if any(not done[j] for j in self.successors[i]):
+                blocking.add(task_id)
+        return blocked, blocking
+
+    def _sort(self):
+        # Kahn's algorithm: the nodes left with predecessors at the end are in or behind a cycle
+        alive = self.alive
+        in_degrees = [len(predecessors) for predecessors in self.predecessors]
+        ready = [i for i, degree in enumerate(in_degrees) if degree == 0 and alive[i]]
+        order = []
+        while ready:
+            i = ready.pop()
+            order.append(i)
+            for j in self.successors[i]:
+                in_degrees[j] -= 1
+                if in_degrees[j] == 0:
+                    ready.append(j)
+        return order
+
+    def sort(self):
+        return self.cached("sort", self._sort)
+
+    def topological_order(self):
+        """Return the ids of the tasks in dependency order, leaving out the tasks in or behind a cycle."""
+        return self.cached("order", lambda: [self.ids[i] for i in self.sort()])
+
+    def _cycles(self):
+        # Tarjan's strongly connected components, iterative, restricted to the nodes left out of the sort
+        candidates = set(range(len(self.ids))) - set(self.sort())
+        candidates = {i for i in candidates if self.alive[i]}
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+        counter = 0
+        for start in candidates:
+            if start in index:
+                continue
+            work = [(start, iter(self.successors[start]))]
+            index[start] = lowlink[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack.add(start)
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if successor not in candidates:
+                        continue
+                    if successor not in index:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(self.successors[successor])))
+                        break
+                    if successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self.successors[node]:
+                            cycles.append([self.ids[i] for i in reversed(component)])
+        return cycles
+
+    def cycles(self):
+        """Return the dependency cycles, as lists of task ids."""
+        return self.cached("cycles", self._cycles)
+
+    def _critical_path(self, duration):
+        durations = self.max_durations if duration == "max" else self.min_durations
+        done, predecessors = self.done, self.predecessors
+        order = self.sort()
+        if not order:
+            return {"duration": 0, "tasks": []}
+        # tasks left out of the sort (in or behind a cycle) keep a finish of -1 and are ignored
+        finish = [-1.0] * len(self.ids)
+        previous = [-1] * len(self.ids)
+        for i in order:
+            start = 0
+            for j in predecessors[i]:
+                if finish[j] > start:
+                    start = finish[j]
+                    previous[i] = j
+            finish[i] = start if done[i] else start + durations[i]
+        last = max(order, key=finish.__getitem__)
+        path = [last]
+        while previous[path[-1]] != -1:
+            path.append(previous[path[-1]])
+        return {"duration": finish[last], "tasks": [self.ids[i] for i in reversed(path)]}
+
+    def critical_path(self, duration="max"):
+        """
+        Return the longest chain of dependencies, weighted by the remaining durations of the tasks.
+
+        Arguments:
+            duration: Whether to use the ``min`` or ``max`` duration of the tasks (done tasks count for nothing).
+
+        Returns:
+            A dictionary with the total ``duration`` in seconds and the ids of the ``tasks`` of the path.
+        """
+        return self.cached(("critical_path", duration), lambda: self._critical_path(duration))
+
+
+def without(items, item):
+    """Return a copy of an array without the first occurrence of an item."""
+    items = array(items.typecode, items)
+    items.remove(item)
+    return items
+
+
+# the current snapshot of the graph, replaced as a whole under the lock
+_graph = None
+_lock = threading.Lock()
+
+
+def get_graph():
+    """Return the dependency graph of this process, reloaded if another process changed the dependencies."""
+    global _graph
+    generation = get_generation(GENERATION)
+    graph = _graph
+    if graph is not None and graph.generation >= generation:
+        return graph
+    with _lock:
+        if _graph is None or _graph.generation < generation:
+            # read before loading: a change made while loading makes the next access load it again
+            graph = DependencyGraph()
+            graph.load()
+            graph.generation = generation
+            _graph = graph
+        return _graph
+
+
+def apply_change(change=None):
+    """
+    Apply a change to the graph of this process once the current transaction is committed.
+
+    Other processes reload their graph on their next access. Without a change, this process reloads it too.
+    """
+
+    def apply():
+        global _graph
+        generation = bump_generation(GENERATION)
+        with _lock:
+            # only keep the graph up-to-date incrementally if nothing else changed it in the meantime,
+            # otherwise it is behind the new generation and is reloaded on the next access
+            if change is not None and _graph is not None and _graph.generation + 1 == generation:
+                graph = _graph.copy()
+                change(graph)
+                graph.generation = generation
+                _graph = graph
+
+    transaction.on_commit(apply)
+
+
+def invalidate_graph(*args, **kwargs):
+    """Reload the graph in every process (after bulk writes, which don't send signals)."""
+    apply_change()
+
+
+def rel_direction(rel_id):
+    title = Rel.objects.filter(pk=rel_id).values_list("title", flat=True).first()
+    if title in settings.DEPENDENCY_RELS["blocks"]:
+        return 1
+    if title in settings.DEPENDENCY_RELS["depends_on"]:
+        return -1
+    return 0
+
+
+def task_rel_saved(sender, instance, created, **kwargs):
+    direction = rel_direction(instance.rel_id)
+    if not direction:
+        return
+    edge = (instance.task1_id, instance.task2_id)[::direction]
+    if created:
+        apply_change(lambda graph: graph.add_edge(*edge))
+    else:
+        # the previous tasks of the relationship are unknown
+        invalidate_graph()
+
+
+def task_rel_deleted(sender, instance, **kwargs):
+    direction = rel_direction(instance.rel_id)
+    if direction:
+        edge = (instance.task1_id, instance.task2_id)[::direction]
+        apply_change(lambda graph: graph.remove_edge(*edge))
+
+
+def loaded_values(instance):
+    """Return the values of the ``TASK_FIELDS`` of a task, or None if some of them are deferred."""
+    if any(field not in instance.__dict__ for field in TASK_FIELDS):
+        return None
+    return tuple(instance.__dict__[field] for field in TASK_FIELDS)
+
+
+def task_initialized(sender, instance, **kwargs):
+    # remember the values loaded from the database, to tell whether a save changes them
+    instance._graph_values = loaded_values(instance)
+
+
+def task_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(TASK_FIELDS) & set(update_fields):
+        return
+    previous = getattr(instance, "_graph_values", None)
+    values = tuple(getattr(instance, field) for field in TASK_FIELDS)
+    instance._graph_values = values
+    if not created and values == previous:
+        return
+    task_id = instance.id
+    apply_change(lambda graph: graph.set_task(task_id, *values))
+
+
+def task_deleted(sender, instance, **kwargs):
+    task_id = instance.id
+    apply_change(lambda graph: graph.remove_task(task_id))
@@ -0,0 +1,107 @@
+"""
+Background sync jobs.
+
+Jobs are queued in the database (``SyncJob``) and run by worker processes (``manage.py sync_worker``),
+so the web application never blocks on long imports. Workers claim jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED``: several workers can run concurrently without any broker.
+
+Running jobs get a heartbeat every ``HEARTBEAT_INTERVAL`` seconds. When a worker dies, its job stops
+beating: after ``STALE_AFTER``, it is queued again for another worker, or failed after ``MAX_ATTEMPTS``.
+"""
+
+import contextlib
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import SyncJob
+from .services.multi import sync
+
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = timedelta(minutes=5)
+MAX_ATTEMPTS = 3
+
+
+class ProgressWriter:
+    """A file-like object saving the last line printed by the services as the job progress, at most every second."""
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self.last_save = 0
+        self.line = ""
+
+    def write(self, text):
+        lines = [line for line in text.splitlines() if line.strip()]
+        if lines:
+            self.line = lines[-1]
+            now = time.monotonic()
+            if now - self.last_save >= self.interval:
+                self.save()
+                self.last_save = now
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def save(self):
+        SyncJob.objects.filter(pk=self.job.pk).update(progress=self.line)
+
+
+def reclaim_stale_jobs():
+    """Queue again the running jobs whose worker stopped beating, or fail them after too many attempts."""
+    now = timezone.now()
+    stale = SyncJob.objects.filter(status=SyncJob.RUNNING, heartbeat_date__lt=now - STALE_AFTER)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=SyncJob.FAILED, error="The worker running the job stopped too many times.", end_date=now
+    )
+    stale.update(status=SyncJob.QUEUED)
+
+
+def claim_job():
+    """Claim the oldest queued job, skipping jobs locked by other workers. Return None if there is none."""
+    reclaim_stale_jobs()
+    with transaction.atomic():
+        queued = SyncJob.objects.select_for_update(skip_locked=True).filter(status=SyncJob.QUEUED)
+        job = queued.order_by("creation_date").first()
+        if job is None:
+            return None
+        job.status = SyncJob.RUNNING
+        job.start_date = job.heartbeat_date = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=["status", "start_date", "heartbeat_date", "attempts"])
+    return job
+
+
+def beat(job, stop):
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            SyncJob.objects.filter(pk=job.pk).update(heartbeat_date=timezone.now())
+    finally:
+        # the thread has its own connection
+        connection.close()
+
+
+def run_job(job):
+    progress = ProgressWriter(job)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=beat, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        with contextlib.redirect_stdout(progress):
+            sync(job.input_services, job.output_service, job.services_options)
+    except Exception:
+        job.status = SyncJob.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = SyncJob.DONE
+    finally:
+        stop.set()
+        heartbeat.join()
+    job.progress = progress.line
+    job.end_date = timezone.now()
+    job.save(update_fields=["status", "error", "progress", "end_date"])
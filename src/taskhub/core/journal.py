@@ -0,0 +1,139 @@
+"""
+Journal of sync runs, to resume interrupted runs from their last checkpoint.
+
+The journal is a local SQLite database. For each run, it records:
+
+- checkpoints: the results of expensive steps (fetched pages, computed mappings),
+  returned as-is instead of being computed again when the run is resumed;
+- writes: the writes already applied to the output service, skipped when the run is resumed.
+
+A run is identified by a name (the input and output services for example).
+Starting a run with the same name as an unfinished one resumes it, unless it started more than ``MAX_AGE``
+seconds ago: its checkpoints would replay stale data, so it is expired instead.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MAX_AGE = 24 * 3600
+
+DEFAULT_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))), "taskhub", "journal.db"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, name TEXT NOT NULL, started REAL NOT NULL, finished REAL);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id INTEGER NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (run_id, key)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    run_id INTEGER NOT NULL, op TEXT NOT NULL, ref TEXT NOT NULL, PRIMARY KEY (run_id, op, ref)
+);
+"""
+
+
+class NullJournal:
+    """A journal that records nothing, used when journaling is disabled."""
+
+    resumed = False
+
+    def get(self, key):
+        return None
+
+    def checkpoint(self, key, compute):
+        return compute()
+
+    def applied(self, op, ref):
+        return False
+
+    def record(self, op, ref):
+        pass
+
+    def finish(self):
+        pass
+
+
+class Journal(NullJournal):
+    def __init__(self, name, path=DEFAULT_PATH, restart=False, max_age=MAX_AGE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # services can be read concurrently in threads (see services.multi), so the connection is shared with a lock
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.executescript(SCHEMA)
+
+        expired = self.connection.execute(
+            "SELECT id FROM runs WHERE name = ? AND finished IS NULL AND started < ?", (name, time.time() - max_age)
+        ).fetchall()
+        for run_id, in expired:
+            self.close_run(run_id)
+            print("Expired interrupted run #{}".format(run_id))
+
+        run = None
+        if not restart:
+            run = self.connection.execute(
+                "SELECT id FROM runs WHERE name = ? AND finished IS NULL ORDER BY id DESC LIMIT 1", (name,)
+            ).fetchone()
+
+        if run:
+            self.run_id = run[0]
+            self.resumed = True
+            print("Resuming interrupted run #{}".format(self.run_id))
+        else:
+            self.run_id = self.connection.execute(
+                "INSERT INTO runs (name, started) VALUES (?, ?)", (name, time.time())
+            ).lastrowid
+
+        self.applied_writes = set(
+            self.connection.execute("SELECT op, ref FROM writes WHERE run_id = ?", (self.run_id,))
+        )
+
+    def get(self, key):
+        """Return the data recorded under ``key`` for this run, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM checkpoints WHERE run_id = ? AND key = ?", (self.run_id, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def checkpoint(self, key, compute):
+        """Return the data recorded under ``key`` for this run, or compute, record and return it."""
+        data = self.get(key)
+        if data is not None:
+            return data
+        data = compute()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO checkpoints (run_id, key, data) VALUES (?, ?, ?)", (self.run_id, key, json.dumps(data))
+            )
+        return data
+
+    def applied(self, op, ref):
+        return (op, ref) in self.applied_writes
+
+    def record(self, op, ref):
+        self.applied_writes.add((op, ref))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO writes (run_id, op, ref) VALUES (?, ?, ?)", (self.run_id, op, ref)
+            )
+
+    def close_run(self, run_id):
+        # the data of finished runs is useless, only keep the run itself. In autocommit mode (isolation_level=None),
+        # the connection context manager opens no transaction: it is explicit, so a crash can't leave half of it
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+                self.connection.execute("DELETE FROM writes WHERE run_id = ?", (run_id,))
+                self.connection.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def finish(self):
+        self.close_run(self.run_id)
+        self.connection.close()
@@ -0,0 +1,27 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ...archive import archive_tasks
+
+
+class Command(BaseCommand):
+    help = "Move the tasks completed some days ago into the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than", dest="older_than", type=float, default=30, help="Days since the completion of the tasks."
+        )
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=1000, help="Tasks moved at once.")
+        parser.add_argument(
+            "--interval", dest="interval", type=float, default=0, help="Run every INTERVAL seconds instead of once."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = archive_tasks(timedelta(days=options["older_than"]), options["batch_size"], progress=False)
+            self.stdout.write("Archived {} tasks".format(count))
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...services import SERVICES, TaskHubService
+
+
+class Command(BaseCommand):
+    help = "Bulk load tasks from an input service into the database, using PostgreSQL's COPY."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-i", "--input-service", dest="input_service", default="stdin")
+        parser.add_argument(
+            "--progress-every", dest="progress_every", type=int, default=100_000, help="Report progress every N rows."
+        )
+
+    def handle(self, *args, **options):
+        input_service = SERVICES[options["input_service"]]()
+        output_service = TaskHubService(copy=True, progress_every=options["progress_every"])
+        output_service.write_tasks(input_service.read_tasks())
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...board import invalidate_board
+from ...ordering import GAP, ORDERINGS, crowded_scopes, rebalance
+
+
+class Command(BaseCommand):
+    help = "Renumber the ordered scopes (status columns, groups) in which positions are running out of room."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-gap",
+            dest="min_gap",
+            type=int,
+            default=GAP // 1024,
+            help="Rebalance scopes in which two consecutive items are closer than this.",
+        )
+
+    def handle(self, *args, **options):
+        for model, (field, _) in ORDERINGS.items():
+            for scope in list(crowded_scopes(model, options["min_gap"])):
+                with transaction.atomic():
+                    rebalance(model.objects.filter(**scope), field)
+                # bulk_update sends no signal: drop the cached boards ourselves
+                invalidate_board()
+                self.stdout.write("Rebalanced {} {}".format(model._meta.verbose_name_plural, scope))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...urgency import refresh_urgency
+
+
+class Command(BaseCommand):
+    help = "Compute the urgency of tasks, and store the ones that changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=10_000, help="Tasks computed at once.")
+        parser.add_argument(
+            "--interval",
+            dest="interval",
+            type=float,
+            default=0,
+            help="Refresh every INTERVAL seconds instead of once (the date terms of urgencies drift with time).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            refresh_urgency(batch_size=options["batch_size"])
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ...extra import sync_extra_indexes
+
+
+class Command(BaseCommand):
+    help = "Create and drop the indexes on the hot keys of Task.extra to match the TASK_EXTRA_INDEXES setting."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrently",
+            dest="concurrently",
+            action="store_true",
+            help="Build the indexes without locking the table against writes (slower).",
+        )
+        parser.add_argument("--database", dest="database", default="default", help="The database alias.")
+
+    def handle(self, *args, **options):
+        created, dropped = sync_extra_indexes(options["database"], options["concurrently"])
+        for name in created:
+            self.stdout.write("Created index {}".format(name))
+        for name in dropped:
+            self.stdout.write("Dropped index {}".format(name))
+        if not created and not dropped:
+            self.stdout.write("Indexes are up-to-date")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued sync jobs. Start as many workers as needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval", dest="poll_interval", type=float, default=2.0, help="Seconds to wait when idle."
+        )
+        parser.add_argument("--once", dest="once", action="store_true", help="Exit when there are no queued jobs.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+            self.stdout.write("Running job {}: {}".format(job.pk, job))
+            run_job(job)
+            self.stdout.write("Job {} {}".format(job.pk, job.status))
@@ -1,7 +1,9 @@
 import uuid
 
 from colorful.fields import RGBColorField
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator
 from django.db import models
 from django.db.models import Q
@@ -35,7 +37,60 @@ class Rel(models.Model):
         return self.title
 
 
-class Task(models.Model):
+class VersionConflict(Exception):
+    """Raised when saving an object that was changed since its version was read."""
+
+    def __init__(self, instance, expected_version):
+        super().__init__(
+            "{} {} is not at version {} anymore".format(instance._meta.verbose_name, instance.pk, expected_version)
+        )
+        self.instance = instance
+        self.expected_version = expected_version
+
+
+class Versioned(models.Model):
+    """
+    Optimistic concurrency: saving an existing object only updates its row if its version did not change
+    since it was read (``UPDATE ... WHERE version = n``), and increments the version. Otherwise, it raises
+    ``VersionConflict``. Set ``version`` to the version a client saw to detect its conflicts.
+    """
+
+    version = models.PositiveIntegerField(verbose_name=_("Version"), default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | {"version"}
+        expected_version = self.version
+        self.version = expected_version + 1
+        self._expected_version = expected_version
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            self.version = expected_version
+            raise
+        finally:
+            self._expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected_version = getattr(self, "_expected_version", None)
+        if expected_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if super()._do_update(
+            base_qs.filter(version=expected_version), using, pk_val, values, update_fields, forced_update
+        ):
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(self, expected_version)
+        # the row was deleted: let Django insert it again, as it does without versions
+        return False
+
+
+class Task(Versioned):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
     title = models.CharField(verbose_name=_("Title"), max_length=255)
@@ -65,13 +120,17 @@ class Task(models.Model):
     # status is flexible: we'll be able to draw columns
     status = models.CharField(verbose_name=_("Status"), max_length=255)
 
-    manual_order = models.PositiveSmallIntegerField(
+    # gap-based: moving a task only updates its own row, see core.ordering
+    manual_order = models.BigIntegerField(
         verbose_name=_("Manual order"),
         help_text=_("The manual order of tasks, used to order the tasks in status columns."),
         default=0,
         blank=True,
     )
 
+    # computed from the other fields, see core.urgency
+    urgency = models.FloatField(verbose_name=_("Urgency"), default=0, editable=False)
+
     # time management, deadlines, etc.
     start_date = models.DateTimeField(
         verbose_name=_("Start date"), help_text=_("The date at which the task starts."), blank=True, null=True
@@ -113,8 +172,28 @@ class Task(models.Model):
         null=True,
     )
 
-    # see taskwarrior issues for types of recurrence
-    # recurrence
+    # occurrences are generated lazily from the rule, and only stored when touched, see core.recurrence
+    recurrence = models.CharField(
+        verbose_name=_("Recurrence"),
+        help_text=_("A recurrence rule, like FREQ=WEEKLY;BYDAY=MO,TH;COUNT=10, starting at the due date."),
+        max_length=255,
+        default="",
+        blank=True,
+    )
+    recurrence_parent = models.ForeignKey(
+        "self",
+        verbose_name=_("Recurring task"),
+        on_delete=models.CASCADE,
+        related_name="occurrences",
+        blank=True,
+        null=True,
+    )
+    occurrence_date = models.DateTimeField(
+        verbose_name=_("Occurrence date"),
+        help_text=_("The date of this occurrence in the series of its recurring task."),
+        blank=True,
+        null=True,
+    )
 
     extra = JSONField(verbose_name=_("Extra"), blank=True, null=True)
 
@@ -132,12 +211,14 @@ class Task(models.Model):
     class Meta:
         verbose_name = _("Task")
         verbose_name_plural = _("Tasks")
+        indexes = [models.Index(fields=["status", "manual_order"]), models.Index(fields=["-urgency"])]
+        unique_together = ("recurrence_parent", "occurrence_date")
 
     def __str__(self):
         return self.title
 
 
-class Group(models.Model):
+class Group(Versioned):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
     title = models.CharField(verbose_name=_("Title"), max_length=255)
@@ -213,12 +294,13 @@ class GroupRel(models.Model):
 class TaskGrouping(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="in_groups")
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="has_tasks")
-    order = models.PositiveSmallIntegerField()
+    order = models.BigIntegerField()
 
     class Meta:
         verbose_name = _("Task in Group")
         verbose_name_plural = _("Tasks in Groups")
         unique_together = ("task", "group")
+        indexes = [models.Index(fields=["group", "order"])]
 
     def __str__(self):
         return f"{self.task} is in {self.group} at pos. {self.order}"
@@ -227,12 +309,82 @@ class TaskGrouping(models.Model):
 class GroupGrouping(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="in_groups")
     in_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="has_groups")
-    order = models.PositiveSmallIntegerField()
+    order = models.BigIntegerField()
 
     class Meta:
         verbose_name = _("Group in Group")
         verbose_name_plural = _("Groups in Groups")
         unique_together = ("group", "in_group")
+        indexes = [models.Index(fields=["in_group", "order"])]
 
     def __str__(self):
         return f"{self.group} is in {self.in_group} at pos. {self.order}"
+
+
+class SyncJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = ((QUEUED, _("Queued")), (RUNNING, _("Running")), (DONE, _("Done")), (FAILED, _("Failed")))
+
+    input_services = JSONField(verbose_name=_("Input services"), default=list)
+    output_service = models.CharField(verbose_name=_("Output service"), max_length=255, default="taskhub")
+    services_options = JSONField(verbose_name=_("Services options"), default=dict, blank=True)
+
+    status = models.CharField(verbose_name=_("Status"), max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.TextField(verbose_name=_("Progress"), help_text=_("The last progress message."), blank=True)
+    error = models.TextField(verbose_name=_("Error"), blank=True)
+
+    creation_date = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+    start_date = models.DateTimeField(verbose_name=_("Start date"), blank=True, null=True)
+    end_date = models.DateTimeField(verbose_name=_("End date"), blank=True, null=True)
+    heartbeat_date = models.DateTimeField(
+        verbose_name=_("Heartbeat date"), help_text=_("Updated periodically by the running worker."), null=True
+    )
+    attempts = models.PositiveSmallIntegerField(verbose_name=_("Attempts"), default=0)
+
+    class Meta:
+        verbose_name = _("Sync job")
+        verbose_name_plural = _("Sync jobs")
+        indexes = [models.Index(fields=["status", "creation_date"])]
+
+    def __str__(self):
+        return f"{'+'.join(self.input_services)} -> {self.output_service} ({self.status})"
+
+
+class ArchivedTask(models.Model):
+    """A completed task moved out of the task table, see core.archive."""
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    title = models.CharField(verbose_name=_("Title"), max_length=255)
+    status = models.CharField(verbose_name=_("Status"), max_length=255)
+    completion_date = models.DateTimeField(verbose_name=_("Completion date"), db_index=True)
+    archive_date = models.DateTimeField(verbose_name=_("Archive date"), auto_now_add=True)
+
+    # references in the services, so synced archived tasks are not imported again
+    refs = ArrayField(models.CharField(max_length=32), verbose_name=_("Reference hashes"), default=list, blank=True)
+    # the task fields, labels, groupings and relationships, to restore the task
+    data = JSONField(verbose_name=_("Data"), encoder=DjangoJSONEncoder)
+
+    class Meta:
+        verbose_name = _("Archived task")
+        verbose_name_plural = _("Archived tasks")
+        indexes = [GinIndex(fields=["refs"])]
+
+    def __str__(self):
+        return self.title
+
+
+class Generation(models.Model):
+    """A counter bumped whenever some cached data changes, see core.generations."""
+
+    name = models.CharField(verbose_name=_("Name"), max_length=64, primary_key=True)
+    value = models.BigIntegerField(verbose_name=_("Value"), default=0)
+
+    class Meta:
+        verbose_name = _("Generation")
+        verbose_name_plural = _("Generations")
+
+    def __str__(self):
+        return f"{self.name} #{self.value}"
@@ -0,0 +1,116 @@
+"""
+Gap-based ordering of tasks and groupings.
+
+Positions are integers spaced by ``GAP``. Moving an item between two others gives it
+the position in the middle of theirs, so a move only updates the moved row.
+When there is no room left between two positions, the whole scope (a status column, a group)
+is renumbered: this is rare, and ``manage.py rebalance_order`` does it in the background for crowded scopes.
+
+Items with the same position are ordered by primary key, as everywhere they are listed. There is no room
+next to such an item for another one, so moving an item next to it renumbers the scope first.
+"""
+
+from django.db import transaction
+
+from .board import invalidate_board
+from .models import GroupGrouping, Task, TaskGrouping
+
+GAP = 1 << 16
+
+# model -> (order field, columns defining the scope in which items are ordered)
+ORDERINGS = {
+    Task: ("manual_order", ("status",)),
+    TaskGrouping: ("order", ("group_id",)),
+    GroupGrouping: ("order", ("in_group_id",)),
+}
+
+
+class NoRoom(Exception):
+    pass
+
+
+def position_between(before, after):
+    """Return a position between two positions (None meaning the start or the end of the scope)."""
+    if before is None and after is None:
+        return 0
+    if before is None:
+        return after - GAP
+    if after is None:
+        return before + GAP
+    if after - before < 2:
+        raise NoRoom
+    return (before + after) // 2
+
+
+def get_scope(obj):
+    field, scope_columns = ORDERINGS[type(obj)]
+    return type(obj).objects.filter(**{c: getattr(obj, c) for c in scope_columns}), field
+
+
+def rebalance(scope, field):
+    """Renumber all the items of a scope, ``GAP`` apart, keeping their current order."""
+    items = list(scope.order_by(field, "pk").only("pk", field))
+    for index, item in enumerate(items):
+        setattr(item, field, index * GAP)
+    scope.model.objects.bulk_update(items, [field], batch_size=1000)
+
+
+def tied(others, field, item):
+    """Whether another item of the scope has the same position as ``item``."""
+    return item is not None and others.filter(**{field: getattr(item, field)}).exclude(pk=item.pk).exists()
+
+
+def move(obj, after=None, before=None):
+    """
+    Move an item right after ``after`` and/or right before ``before``, two items of the same scope.
+
+    With only one neighbor, the other one is looked up. With none, the item goes to the end of its scope.
+    Only the moved row is updated, unless the scope has to be rebalanced.
+    """
+    scope, field = get_scope(obj)
+    others = scope.exclude(pk=obj.pk)
+
+    with transaction.atomic():
+        for attempt in range(2):
+            after_pos = getattr(after, field) if after is not None else None
+            before_pos = getattr(before, field) if before is not None else None
+            if after is not None and before is None:
+                next_item = others.filter(**{field + "__gt": after_pos}).order_by(field).first()
+                before_pos = getattr(next_item, field) if next_item else None
+            elif before is not None and after is None:
+                previous_item = others.filter(**{field + "__lt": before_pos}).order_by("-" + field).first()
+                after_pos = getattr(previous_item, field) if previous_item else None
+            elif after is None and before is None:
+                last_item = others.order_by("-" + field).first()
+                after_pos = getattr(last_item, field) if last_item else None
+
+            try:
+                if tied(others, field, after) or tied(others, field, before):
+                    raise NoRoom
+                position = position_between(after_pos, before_pos)
+            except NoRoom:
+                rebalance(scope, field)
+                for neighbor in (after, before):
+                    if neighbor is not None:
+                        neighbor.refresh_from_db(fields=[field])
+                continue
+
+            setattr(obj, field, position)
+            type(obj).objects.filter(pk=obj.pk).update(**{field: position})
+            invalidate_board()
+            return position
+
+    raise NoRoom
+
+
+def crowded_scopes(model, min_gap=2):
+    """Yield the scopes of a model in which two consecutive items are less than ``min_gap`` apart."""
+    field, scope_columns = ORDERINGS[model]
+    rows = model.objects.order_by(*scope_columns, field).values_list(*scope_columns, field)
+    previous_scope = previous_position = crowded_scope = None
+    for row in rows.iterator():
+        scope, position = row[:-1], row[-1]
+        if scope == previous_scope and scope != crowded_scope and position - previous_position < min_gap:
+            crowded_scope = scope
+            yield dict(zip(scope_columns, scope))
+        previous_scope, previous_position = scope, position
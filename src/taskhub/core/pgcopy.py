@@ -0,0 +1,309 @@
+"""
+Bulk loading of tasks into PostgreSQL with ``COPY FROM STDIN``.
+
+Tasks are streamed into temporary staging tables, then upserted into the real tables with set-based SQL.
+This is much faster than ``bulk_create`` for initial imports of millions of tasks.
+
+Like the batched writes, completed tasks that were archived are skipped, and reopened ones are restored
+from the archive (see ``core.archive``), with their archived id, labels, groupings and relationships.
+Existing tasks are only updated if their version did not change since it was read (see ``core.concurrency``):
+tasks changed concurrently are skipped and reported, the next sync updating them.
+"""
+
+import json
+import time
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+
+from .models import ArchivedTask, Group, Label, Task, TaskGroupRel, TaskGrouping, TaskRef, TaskRel
+
+STAGING_TASKS = "taskhub_staging_task"
+STAGING_GROUPINGS = "taskhub_staging_grouping"
+
+# model fields copied as-is into the staging table, with their SQL type
+TASK_COLUMNS = [
+    ("id", "uuid"),
+    ("title", "varchar(255)"),
+    ("description", "text"),
+    ("priority", "smallint"),
+    ("confidential", "boolean"),
+    ("creation_date", "timestamp with time zone"),
+    ("completion_date", "timestamp with time zone"),
+    ("last_update", "timestamp with time zone"),
+    ("status", "varchar(255)"),
+    ("manual_order", "bigint"),
+    ("urgency", "double precision"),
+    ("start_date", "timestamp with time zone"),
+    ("min_duration", "interval"),
+    ("max_duration", "interval"),
+    ("due_date", "timestamp with time zone"),
+    ("expiration_date", "timestamp with time zone"),
+    ("wait_date", "timestamp with time zone"),
+    ("scheduled", "timestamp with time zone"),
+    ("recurrence", "varchar(255)"),
+    ("extra", "jsonb"),
+    ("version", "integer"),
+]
+
+# columns owned by TaskHub: the manual order is set in the frontend, and urgencies are computed after the load
+LOCAL_COLUMNS = {"manual_order", "urgency"}
+
+
+def to_csv_value(value):
+    # unquoted empty values are NULLs in PostgreSQL CSV format, quoted empty values are empty strings
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = "true" if value else "false"
+    elif isinstance(value, date):
+        value = value.isoformat()
+    elif isinstance(value, timedelta):
+        value = "{} seconds".format(value.total_seconds())
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+def to_csv_line(values):
+    return ",".join(to_csv_value(v) for v in values) + "\n"
+
+
+class LineStream:
+    """
+    A read-only file-like object over an iterable of lines, as expected by ``cursor.copy_expert``.
+
+    It reports progress every ``progress_every`` lines.
+    """
+
+    def __init__(self, lines, progress_every=100_000, label="rows"):
+        self.lines = iter(lines)
+        self.buffer = ""
+        self.count = 0
+        self.progress_every = progress_every
+        self.label = label
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+            self.count += 1
+            if self.progress_every and self.count % self.progress_every == 0:
+                print("Streamed {} {}".format(self.count, self.label))
+        if size < 0:
+            data, self.buffer = self.buffer, ""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def restore_archived(cursor):
+    """
+    Restore the archived tasks that the staging table got the ids of, then delete them from the archive.
+
+    Their fields come from the staging table. The labels, groupings and relationships of their snapshots
+    are restored when the other side still exists, like ``core.archive.restore_task`` does.
+
+    Returns:
+        The number of restored tasks.
+    """
+    tables = {
+        "staging": STAGING_TASKS,
+        "archive": ArchivedTask._meta.db_table,
+        "task": Task._meta.db_table,
+        "refs": TaskRef._meta.db_table,
+        "labels": Label._meta.db_table,
+        "task_labels": Task.labels.through._meta.db_table,
+        "group": Group._meta.db_table,
+        "groupings": TaskGrouping._meta.db_table,
+        "group_rels": TaskGroupRel._meta.db_table,
+        "rels": TaskRel._meta.db_table,
+    }
+    # the archived tasks being restored, with their snapshots
+    restored = "(SELECT a.id, a.refs, a.data FROM {archive} a WHERE a.id IN (SELECT id FROM {staging}))"
+    tables["restored"] = restored.format(**tables)
+
+    cursor.execute(
+        "INSERT INTO {refs} (task_id, ref) SELECT a.id, r.ref FROM {restored} a, unnest(a.refs) r(ref) "
+        "ON CONFLICT (ref) DO NOTHING".format(**tables)
+    )
+    cursor.execute(
+        "INSERT INTO {task_labels} (task_id, label_id) "
+        "SELECT a.id, l.id FROM {restored} a, jsonb_array_elements_text(a.data->'labels') t(label_id) "
+        "JOIN {labels} l ON l.id = t.label_id::integer "
+        "ON CONFLICT DO NOTHING".format(**tables)
+    )
+    cursor.execute(
+        "INSERT INTO {groupings} (task_id, group_id, \"order\") "
+        "SELECT a.id, g.id, (t.value->>1)::bigint FROM {restored} a, jsonb_array_elements(a.data->'groupings') t "
+        "JOIN {group} g ON g.id = (t.value->>0)::uuid "
+        "ON CONFLICT (task_id, group_id) DO NOTHING".format(**tables)
+    )
+    cursor.execute(
+        "INSERT INTO {group_rels} (task_id, group_id, rel_id) "
+        "SELECT a.id, g.id, (t.value->>1)::integer FROM {restored} a, jsonb_array_elements(a.data->'group_rels') t "
+        "JOIN {group} g ON g.id = (t.value->>0)::uuid".format(**tables)
+    )
+    # a relationship between two restored tasks is in both snapshots
+    cursor.execute(
+        "INSERT INTO {rels} (task1_id, task2_id, rel_id) "
+        "SELECT DISTINCT (t.value->>0)::uuid, (t.value->>1)::uuid, (t.value->>2)::integer "
+        "FROM {restored} a, jsonb_array_elements(a.data->'rels') t "
+        "WHERE EXISTS (SELECT 1 FROM {task} WHERE id = (t.value->>0)::uuid) "
+        "AND EXISTS (SELECT 1 FROM {task} WHERE id = (t.value->>1)::uuid)".format(**tables)
+    )
+    cursor.execute("DELETE FROM {archive} WHERE id IN (SELECT id FROM {staging})".format(**tables))
+    return cursor.rowcount
+
+
+def copy_tasks(tasks, task_groupings=(), get_ref=None, progress_every=100_000):
+    """
+    Load tasks (and the groupings between tasks and groups) with ``COPY``.
+
+    The groups referenced by ``task_groupings`` must already exist in the database.
+
+    Returns:
+        The numbers of created and updated tasks, of archived tasks that were skipped, and of tasks skipped
+        because they changed during the load (conflicts).
+    """
+    task_table = Task._meta.db_table
+    ref_table = TaskRef._meta.db_table
+    label_table = Label._meta.db_table
+    task_label_table = Task.labels.through._meta.db_table
+    grouping_table = TaskGrouping._meta.db_table
+    columns = [c for c, _ in TASK_COLUMNS]
+    staging_columns = ", ".join("{} {}".format(c, t) for c, t in TASK_COLUMNS)
+
+    def task_lines():
+        for task in tasks:
+            values = [getattr(task, c) for c in columns]
+            values.append(get_ref(task))
+            values.append(list(getattr(task, "label_titles", ())))
+            yield to_csv_line(values)
+
+    def grouping_lines():
+        for grouping in task_groupings:
+            yield to_csv_line([get_ref(grouping.task), grouping.group_id, grouping.order])
+
+    start = time.time()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE {} ({}, ref varchar(32), label_titles jsonb) ON COMMIT DROP".format(
+                STAGING_TASKS, staging_columns
+            )
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE {} (ref varchar(32), group_id uuid, \"order\" bigint) ON COMMIT DROP".format(
+                STAGING_GROUPINGS
+            )
+        )
+
+        print("Streaming tasks into the staging table...")
+        stream = LineStream(task_lines(), progress_every=progress_every, label="tasks")
+        cursor.copy_expert(
+            "COPY {} ({}, ref, label_titles) FROM STDIN WITH (FORMAT csv)".format(STAGING_TASKS, ", ".join(columns)),
+            stream,
+        )
+        count = stream.count
+
+        print("Streaming groupings into the staging table...")
+        stream = LineStream(grouping_lines(), progress_every=progress_every, label="groupings")
+        cursor.copy_expert("COPY {} FROM STDIN WITH (FORMAT csv)".format(STAGING_GROUPINGS), stream)
+
+        cursor.execute("ANALYZE {}".format(STAGING_TASKS))
+
+        # completed tasks that were archived are not imported again (see core.archive)
+        cursor.execute(
+            "DELETE FROM {staging} s USING {archive} a "
+            "WHERE s.completion_date IS NOT NULL AND a.refs @> ARRAY[s.ref]::varchar(32)[] RETURNING a.id".format(
+                staging=STAGING_TASKS, archive=ArchivedTask._meta.db_table
+            )
+        )
+        archived = len({task_id for task_id, in cursor.fetchall()})
+
+        print("Upserting tasks...")
+        cursor.execute(
+            "UPDATE {staging} s SET id = r.task_id FROM {refs} r WHERE r.ref = s.ref".format(
+                staging=STAGING_TASKS, refs=ref_table
+            )
+        )
+        # the archived tasks left match reopened tasks: they get their archived id back, to be restored
+        cursor.execute(
+            "UPDATE {staging} s SET id = a.id FROM {archive} a WHERE a.refs @> ARRAY[s.ref]::varchar(32)[]".format(
+                staging=STAGING_TASKS, archive=ArchivedTask._meta.db_table
+            )
+        )
+        # the versions read here are the ones expected by the update
+        cursor.execute(
+            "UPDATE {staging} s SET version = t.version FROM {table} t WHERE t.id = s.id".format(
+                staging=STAGING_TASKS, table=task_table
+            )
+        )
+        # of the rows of a same task, the most recently updated one wins. The rows of the tasks that
+        # were changed since their version was read are left out of the next steps.
+        # Inserted rows have no deleting transaction yet (xmax = 0), updated ones have.
+        cursor.execute(
+            "WITH written AS ("
+            "INSERT INTO {table} ({columns}) SELECT DISTINCT ON (id) {columns} FROM {staging} "
+            "ORDER BY id, last_update DESC NULLS LAST "
+            "ON CONFLICT (id) DO UPDATE SET {updates}, version = {table}.version + 1 "
+            "WHERE {table}.version = EXCLUDED.version RETURNING id, xmax = 0 AS inserted"
+            "), skipped AS ("
+            "DELETE FROM {staging} s WHERE NOT EXISTS (SELECT 1 FROM written w WHERE w.id = s.id) RETURNING s.id"
+            ") SELECT (SELECT COUNT(*) FROM written WHERE inserted), "
+            "(SELECT COUNT(*) FROM written WHERE NOT inserted), (SELECT COUNT(DISTINCT id) FROM skipped)".format(
+                table=task_table,
+                staging=STAGING_TASKS,
+                columns=", ".join(columns),
+                # updated tasks get a new version, so concurrent edits based on the previous one are rejected
+                updates=", ".join(
+                    "{0} = EXCLUDED.{0}".format(c) for c in columns if c not in {"id", "version"} | LOCAL_COLUMNS
+                ),
+            )
+        )
+        created, updated, conflicts = cursor.fetchone()
+        cursor.execute(
+            "INSERT INTO {refs} (task_id, ref) SELECT id, ref FROM {staging} ON CONFLICT (ref) DO NOTHING".format(
+                staging=STAGING_TASKS, refs=ref_table
+            )
+        )
+        restored = restore_archived(cursor)
+        if restored:
+            print("Restored {} archived tasks".format(restored))
+
+        print("Upserting labels...")
+        cursor.execute(
+            "INSERT INTO {labels} (title, description, color) "
+            "SELECT DISTINCT t.title, '', '' FROM {staging} s, jsonb_array_elements_text(s.label_titles) t(title) "
+            "WHERE NOT EXISTS (SELECT 1 FROM {labels} l WHERE l.title = t.title)".format(
+                staging=STAGING_TASKS, labels=label_table
+            )
+        )
+        cursor.execute(
+            "INSERT INTO {task_labels} (task_id, label_id) "
+            "SELECT DISTINCT s.id, l.id FROM {staging} s, jsonb_array_elements_text(s.label_titles) t(title) "
+            "JOIN {labels} l ON l.title = t.title "
+            "ON CONFLICT DO NOTHING".format(staging=STAGING_TASKS, labels=label_table, task_labels=task_label_table)
+        )
+
+        print("Upserting groupings...")
+        # like the batched writes, existing groupings keep their order, which may have been moved in the frontend.
+        # Of the groupings of a same task, the ones of its most recently updated row win.
+        cursor.execute(
+            "INSERT INTO {groupings} (task_id, group_id, \"order\") "
+            "SELECT DISTINCT ON (s.id, g.group_id) s.id, g.group_id, g.\"order\" "
+            "FROM {staging_groupings} g JOIN {staging} s ON s.ref = g.ref "
+            "ORDER BY s.id, g.group_id, s.last_update DESC NULLS LAST, g.\"order\" "
+            "ON CONFLICT (task_id, group_id) DO NOTHING".format(
+                staging=STAGING_TASKS, staging_groupings=STAGING_GROUPINGS, groupings=grouping_table
+            )
+        )
+
+    elapsed = time.time() - start
+    print("Loaded {} tasks in {:.1f}s ({:.0f} rows/sec)".format(count, elapsed, count / elapsed if elapsed else 0))
+    return created, updated, archived, conflicts
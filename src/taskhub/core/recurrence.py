@@ -0,0 +1,272 @@
+"""
+Lazy recurrence of tasks.
+
+A recurring task is a template: a task with a ``recurrence`` rule, written in a subset of iCalendar's RRULE syntax
+(``FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=10``). Its due date (or creation date) is the start of the series.
+As in iCalendar, ``UNTIL`` is a UTC date-time in the basic format (``20201231T235959Z``) or a date (``20201231``,
+until the end of that day); the extended format with a timezone (``2020-12-31T23:59:59+02:00``) is also accepted.
+
+Occurrences are not stored up-front: they are generated over a requested time window.
+The generator jumps straight to the first period of the window, so the cost of a query only depends
+on the number of occurrences in the window, not on the length of the series.
+An occurrence is only stored as a task (linked to its template) when it is touched: edited, completed...
+Stored occurrences replace the generated ones in the windows.
+
+Like TaskWarrior, monthly and yearly occurrences falling on days missing from shorter months
+(the 31st, February 29th) are moved to the last day of the month.
+"""
+
+import calendar
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Task
+from .timestamps import TW_FORMAT, UTC, parse_tw
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+# fields copied from the template to its stored occurrences
+TEMPLATE_FIELDS = [
+    "title",
+    "description",
+    "priority",
+    "confidential",
+    "status",
+    "min_duration",
+    "max_duration",
+    "extra",
+]
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def parse_until(value):
+    """Parse the ``UNTIL`` of a rule, in the basic or extended ISO 8601 format, into an aware datetime."""
+    try:
+        if len(value) == 16 and value.endswith("Z"):
+            return parse_tw(value)
+        if len(value) == 8 and value.isdigit():
+            return parse_tw(value + "T235959Z")
+        until = parse_datetime(value)
+    except ValueError:
+        until = None
+    if until is None or until.tzinfo is None:
+        raise ValueError("UNTIL must be a UTC date-time (20201231T235959Z), a date, or a date-time with a timezone")
+    return until
+
+
+class Rule:
+    """
+    A recurrence rule.
+
+    Arguments:
+        freq: One of ``FREQUENCIES``.
+        interval: The number of periods between two occurrences.
+        count: The maximum number of occurrences.
+        until: The date after which there are no more occurrences.
+        byday: For weekly rules, the days of the week (indexes in ``WEEKDAYS``) of the occurrences.
+    """
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=()):
+        if freq not in FREQUENCIES:
+            raise ValueError("FREQ must be one of {}".format(", ".join(FREQUENCIES)))
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError("INTERVAL and COUNT must be positive")
+        if byday and freq != "WEEKLY":
+            raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = sorted(set(byday))
+
+    @classmethod
+    def parse(cls, text):
+        """Parse a rule, raising ValueError when it is invalid or unsupported."""
+        parts = {}
+        for part in text.upper().replace("RRULE:", "").split(";"):
+            key, _, value = part.partition("=")
+            parts[key.strip()] = value.strip()
+        unknown = parts.keys() - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY"}
+        if unknown:
+            raise ValueError("Unsupported parts: {}".format(", ".join(sorted(unknown))))
+
+        until = None
+        if parts.get("UNTIL"):
+            until = parse_until(parts["UNTIL"])
+        byday = []
+        for day in filter(None, parts.get("BYDAY", "").split(",")):
+            if day not in WEEKDAYS:
+                raise ValueError("BYDAY must be made of {}".format(", ".join(WEEKDAYS)))
+            byday.append(WEEKDAYS.index(day))
+        return cls(
+            parts.get("FREQ"),
+            interval=int(parts.get("INTERVAL") or 1),
+            count=int(parts["COUNT"]) if parts.get("COUNT") else None,
+            until=until,
+            byday=byday,
+        )
+
+    def __str__(self):
+        parts = ["FREQ=" + self.freq]
+        if self.interval != 1:
+            parts.append("INTERVAL={}".format(self.interval))
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[day] for day in self.byday))
+        if self.count is not None:
+            parts.append("COUNT={}".format(self.count))
+        if self.until is not None:
+            parts.append("UNTIL=" + self.until.astimezone(UTC).strftime(TW_FORMAT))
+        return ";".join(parts)
+
+    def period_start(self, dtstart, k):
+        if self.freq == "DAILY":
+            return dtstart + timedelta(days=k * self.interval)
+        if self.freq == "WEEKLY":
+            return dtstart + timedelta(weeks=k * self.interval)
+        if self.freq == "MONTHLY":
+            return add_months(dtstart, k * self.interval)
+        return add_months(dtstart, 12 * k * self.interval)
+
+    def period_index(self, dtstart, when):
+        """Return the index of a period starting at or before ``when`` (maybe a few periods before)."""
+        if when <= dtstart:
+            return 0
+        if self.freq in ("DAILY", "WEEKLY"):
+            step = timedelta(days=self.interval * (1 if self.freq == "DAILY" else 7))
+            return (when - dtstart) // step
+        months = (when.year - dtstart.year) * 12 + when.month - dtstart.month
+        if self.freq == "YEARLY":
+            months //= 12
+        # one period back: the month difference doesn't account for the day of the month
+        return max(months // self.interval - 1, 0)
+
+    def period_occurrences(self, dtstart, k):
+        start = self.period_start(dtstart, k)
+        if not self.byday:
+            return [start]
+        monday = start - timedelta(days=start.weekday())
+        # only the occurrences of the first week that are not before the start of the series
+        return [monday + timedelta(days=day) for day in self.byday if k or day >= dtstart.weekday()]
+
+    def occurrences_before(self, dtstart, k):
+        """Return the number of occurrences in the periods before period ``k``."""
+        if not k:
+            return 0
+        if not self.byday:
+            return k
+        return len(self.period_occurrences(dtstart, 0)) + (k - 1) * len(self.byday)
+
+    def between(self, dtstart, start, end):
+        """
+        Generate the occurrences of a series in a window.
+
+        Arguments:
+            dtstart: The start of the series.
+            start: The start of the window (included).
+            end: The end of the window (excluded).
+
+        Yields:
+            Tuples of occurrence number (starting at 1) and date.
+        """
+        k = self.period_index(dtstart, start)
+        number = self.occurrences_before(dtstart, k)
+        while True:
+            for occurrence in self.period_occurrences(dtstart, k):
+                number += 1
+                if self.count is not None and number > self.count:
+                    return
+                if (self.until is not None and occurrence > self.until) or occurrence >= end:
+                    return
+                if occurrence >= start:
+                    yield number, occurrence
+            k += 1
+
+    def is_occurrence(self, dtstart, when):
+        return any(True for _ in self.between(dtstart, when, when + timedelta(microseconds=1)))
+
+
+def series_start(template):
+    return template.due_date or template.creation_date
+
+
+def occurrence_row(template, number, date, stored=None):
+    task = stored or template
+    return {
+        "id": str(stored.id) if stored else None,
+        "template": str(template.id),
+        "number": number,
+        "occurrence_date": date,
+        "title": task.title,
+        "status": task.status,
+        "priority": task.priority,
+        "due_date": stored.due_date if stored else date,
+        "completion_date": stored.completion_date if stored else None,
+    }
+
+
+def expand(templates, start, end):
+    """
+    List the occurrences of recurring tasks in a window, generated or stored.
+
+    Arguments:
+        templates: A queryset of recurring tasks (with a ``recurrence`` rule).
+        start: The start of the window (included).
+        end: The end of the window (excluded).
+
+    Returns:
+        A list of dictionaries (see ``occurrence_row``) sorted by date.
+    """
+    templates = list(
+        templates.filter(recurrence__gt="").filter(
+            Q(due_date__lt=end) | Q(due_date__isnull=True, creation_date__lt=end)
+        )
+    )
+    stored = {
+        (task.recurrence_parent_id, task.occurrence_date): task
+        for task in Task.objects.filter(
+            recurrence_parent__in=templates, occurrence_date__gte=start, occurrence_date__lt=end
+        )
+    }
+    rows = []
+    for template in templates:
+        try:
+            rule = Rule.parse(template.recurrence)
+        except ValueError:
+            continue
+        for number, date in rule.between(series_start(template), start, end):
+            rows.append(occurrence_row(template, number, date, stored.get((template.id, date))))
+    rows.sort(key=lambda row: row["occurrence_date"])
+    return rows
+
+
+def materialize(template, occurrence_date):
+    """
+    Return the stored task of an occurrence, creating it from its template if needed.
+
+    Raises:
+        ValueError: When the date is not an occurrence of the template.
+    """
+    if not Rule.parse(template.recurrence).is_occurrence(series_start(template), occurrence_date):
+        raise ValueError("Not an occurrence of this task")
+    with transaction.atomic():
+        task, created = Task.objects.get_or_create(
+            recurrence_parent=template,
+            occurrence_date=occurrence_date,
+            defaults=dict(
+                {field: getattr(template, field) for field in TEMPLATE_FIELDS},
+                creation_date=template.creation_date,
+                due_date=occurrence_date,
+            ),
+        )
+        if created:
+            task.labels.set(template.labels.all())
+    return task
@@ -0,0 +1,38 @@
+"""
+JSON renderer and parser based on orjson, much faster than the standard library.
+
+orjson is optional: without it, they behave like the default DRF JSON renderer and parser.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # types orjson doesn't know (lazy translations, decimals, querysets...) go through DRF's encoder
+    default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        # UTC datetimes end with Z, like with DRF's encoder
+        return orjson.dumps(data, default=self.default, option=orjson.OPT_UTC_Z)
+
+
+class ORJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError("JSON parse error - %s" % error)
@@ -0,0 +1,98 @@
+"""
+Database routing to read replicas.
+
+Reads go to the replicas (``settings.DATABASE_REPLICAS``) only within ``reading_from_replicas()``,
+which the API viewsets enter for safe methods (see ``views.ReplicaReadMixin``). Everything else,
+writes included, goes to the primary database.
+
+After a write, ``PrimaryPinningMiddleware`` pins the client to the primary for ``READ_YOUR_WRITES_WINDOW`` seconds,
+so clients read their own writes even if replicas lag. Replicas lagging more than ``REPLICA_MAX_LAG`` seconds
+are skipped.
+"""
+
+import contextlib
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = "taskhub_primary_until"
+LAG_CHECK_INTERVAL = 5
+
+_state = threading.local()
+_lags = {}
+
+
+@contextlib.contextmanager
+def reading_from_replicas(enabled=True):
+    previous = getattr(_state, "replicas", False)
+    _state.replicas = enabled
+    try:
+        yield
+    finally:
+        _state.replicas = previous
+
+
+def replica_lag(alias):
+    """Return the replication lag of a replica in seconds, checked at most every ``LAG_CHECK_INTERVAL`` seconds."""
+    checked, lag = _lags.get(alias, (0, 0))
+    now = time.monotonic()
+    if now - checked > LAG_CHECK_INTERVAL:
+        connection = connections[alias]
+        if connection.vendor == "postgresql":
+            try:
+                with connection.cursor() as cursor:
+                    # the replay timestamp is the one of the last replayed transaction: it keeps growing while
+                    # the primary is idle, so a replica that replayed everything it received doesn't lag
+                    cursor.execute(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                    )
+                    lag = float(cursor.fetchone()[0] or 0)
+            except Exception:
+                lag = float("inf")
+        # other backends (SQLite stand-ins for example) don't replicate, so they don't lag
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, "replicas", False):
+            return DEFAULT_DB_ALIAS
+        max_lag = getattr(settings, "REPLICA_MAX_LAG", 5)
+        replicas = [alias for alias in getattr(settings, "DATABASE_REPLICAS", []) if replica_lag(alias) <= max_lag]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinningMiddleware:
+    """Pin clients to the primary database for a while after they write, to read their own writes."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            window = getattr(settings, "READ_YOUR_WRITES_WINDOW", 10)
+            response.set_cookie(PIN_COOKIE, str(time.time() + window), max_age=window)
+        return response
@@ -0,0 +1,41 @@
+"""
+Indexes for the title searches of the admin on the large tables (tasks, archived tasks).
+
+These admins search titles by prefix (``^title``), which Django turns into ``UPPER(title::text) LIKE UPPER('...%')``.
+Only an index on that very expression, with the ``text_pattern_ops`` operator class, turns it into an index scan,
+and Django 2.2 cannot declare expression indexes in ``Meta.indexes``: they are created after each ``migrate``,
+like the indexes of ``core.extra``.
+"""
+
+from django.db import connections
+
+from .models import ArchivedTask, Task
+
+SEARCH_FIELDS = [(Task, "title"), (ArchivedTask, "title")]
+
+
+def create_search_indexes(using="default"):
+    """Create the missing search indexes, and return their names."""
+    created = []
+    with connections[using].cursor() as cursor:
+        for model, field_name in SEARCH_FIELDS:
+            table = model._meta.db_table
+            column = model._meta.get_field(field_name).column
+            name = "{}_{}_upper_like".format(table, column)
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s", [table, name])
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    'CREATE INDEX IF NOT EXISTS "{}" ON "{}" ((UPPER("{}"::text)) text_pattern_ops)'.format(
+                        name, table, column
+                    )
+                )
+                created.append(name)
+    return created
+
+
+def create_search_indexes_after_migrate(sender, using="default", verbosity=1, **kwargs):
+    if connections[using].vendor != "postgresql":
+        return
+    for name in create_search_indexes(using):
+        if verbosity:
+            print("  Created index {}".format(name))
@@ -1,7 +1,11 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import User
+from django.db import models
 from rest_framework import serializers
 
-from .models import Task, Label, Group
+from .models import ArchivedTask, Task, Label, Group, SyncJob, TaskGrouping
+from .recurrence import Rule
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -19,7 +23,169 @@ class LabelSerializer(serializers.ModelSerializer):
 class TaskSerializer(serializers.ModelSerializer):
     class Meta:
         model = Task
-        fields = ["id", "title", "description", "priority", "confidential"]
+        fields = ["id", "title", "description", "priority", "confidential", "urgency", "recurrence", "version"]
+
+    def validate_recurrence(self, value):
+        if value:
+            try:
+                value = str(Rule.parse(value))
+            except ValueError as error:
+                raise serializers.ValidationError(str(error))
+        return value
+
+
+class WindowSerializer(serializers.Serializer):
+    """A time window of at most a year (calendar queries)."""
+
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+    def validate(self, data):
+        if not data["start"] < data["end"] <= data["start"] + timedelta(days=366):
+            raise serializers.ValidationError("end must be after start, by one year at most")
+        return data
+
+
+class OccurrenceSerializer(serializers.Serializer):
+    occurrence_date = serializers.DateTimeField()
+
+
+class MoveSerializer(serializers.Serializer):
+    """A move of a task in its status column: right after and/or right before other tasks."""
+
+    task = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False)
+    after = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False, allow_null=True)
+    before = serializers.PrimaryKeyRelatedField(queryset=Task.objects.all(), required=False, allow_null=True)
+
+    def validate(self, data):
+        # the task of the URL, when there is one, is the task moved
+        task = self.context.get("task")
+        if task is not None and data.get("task", task) != task:
+            raise serializers.ValidationError({"task": "The task to move is the one of the URL."})
+        task = data["task"] = task or data.get("task")
+        if task is None:
+            raise serializers.ValidationError("Missing task to move.")
+        for neighbor in (data.get("after"), data.get("before")):
+            if neighbor is not None and (neighbor.status != task.status or neighbor.pk == task.pk):
+                raise serializers.ValidationError("Neighbors must be other tasks with the same status.")
+        return data
+
+
+class GroupingMoveSerializer(serializers.Serializer):
+    """
+    A move of a task or a subgroup in a group: right after and/or right before other items of the group.
+
+    The context gives the ``groupings`` of the group and the ``column`` holding their item ids;
+    the validated data holds the groupings of the items.
+    """
+
+    item = serializers.UUIDField()
+    after = serializers.UUIDField(required=False, allow_null=True)
+    before = serializers.UUIDField(required=False, allow_null=True)
+
+    def validate(self, data):
+        column = self.context["column"]
+        ids = [data[name] for name in ("item", "after", "before") if data.get(name) is not None]
+        groupings = {getattr(g, column): g for g in self.context["groupings"].filter(**{column + "__in": ids})}
+        if data["item"] not in groupings:
+            raise serializers.ValidationError("The item to move is not in this group.")
+        for name in ("after", "before"):
+            if data.get(name) is not None and (data[name] not in groupings or data[name] == data["item"]):
+                raise serializers.ValidationError("Neighbors must be other items of the same group.")
+        return {name: groupings.get(data.get(name)) for name in ("item", "after", "before")}
+
+
+class ArchivedTaskSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedTask
+        fields = ["id", "title", "status", "completion_date", "archive_date", "refs"]
+
+
+# services and options accepted in sync jobs created through the API, with their type and choices.
+# Tokens and API URLs are left out: they would let clients send the server's tokens anywhere.
+# The standard input and output services are left out too: they would block the worker.
+JOB_SERVICES_OPTIONS = {
+    "github": {
+        "users": (str, None),
+        "orgs": (str, None),
+        "api": (str, ("rest", "graphql")),
+        "repo": (str, None),
+        "writers": (int, None),
+        "rate": (float, None),
+    },
+    "taskhub": {
+        "batch_size": (int, None),
+        "copy": (bool, None),
+        "progress_every": (int, None),
+        "on_conflict": (str, ("retry", "skip")),
+    },
+    "taskwarrior": {"reader": (str, ("export", "taskw"))},
+}
+
+
+def check_option_value(value, expected_type, choices):
+    # booleans are integers in Python, don't accept them as numbers
+    if isinstance(value, bool) and expected_type is not bool:
+        return False
+    if expected_type is float:
+        expected_type = (int, float)
+    if not isinstance(value, expected_type):
+        return False
+    return choices is None or value in choices
+
+
+class SyncJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SyncJob
+        fields = [
+            "id",
+            "input_services",
+            "output_service",
+            "services_options",
+            "status",
+            "progress",
+            "error",
+            "creation_date",
+            "start_date",
+            "end_date",
+        ]
+        read_only_fields = ["status", "progress", "error", "creation_date", "start_date", "end_date"]
+
+    @staticmethod
+    def get_services_names():
+        return sorted(JOB_SERVICES_OPTIONS)
+
+    def validate_input_services(self, value):
+        names = self.get_services_names()
+        if not value or not all(name in names for name in value):
+            raise serializers.ValidationError(f"Choose one or more services among: {', '.join(names)}")
+        return value
+
+    def validate_output_service(self, value):
+        names = self.get_services_names()
+        if value not in names:
+            raise serializers.ValidationError(f"Choose a service among: {', '.join(names)}")
+        return value
+
+    def validate_services_options(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected a dictionary of options by service.")
+        for service, options in value.items():
+            allowed = JOB_SERVICES_OPTIONS.get(service)
+            if allowed is None:
+                raise serializers.ValidationError(f"Unknown service: {service}")
+            if not isinstance(options, dict):
+                raise serializers.ValidationError(f"Expected a dictionary of options for {service}.")
+            for name, option_value in options.items():
+                if name not in allowed:
+                    raise serializers.ValidationError(
+                        f"Option {name} of {service} is not allowed, choose among: {', '.join(sorted(allowed))}"
+                    )
+                expected_type, choices = allowed[name]
+                if not check_option_value(option_value, expected_type, choices):
+                    expected = ", ".join(map(str, choices)) if choices else expected_type.__name__
+                    raise serializers.ValidationError(f"Invalid value for {service}.{name}, expected: {expected}")
+        return value
 
 
 class GroupSerializer(serializers.ModelSerializer):
@@ -28,9 +194,88 @@ class GroupSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Group
-        fields = ["id", "title", "description", "labels", "tasks"]
+        fields = ["id", "title", "description", "version", "labels", "tasks"]
 
     # def create(self, validated_data):
     #     labels_data = validated_data.pop("labels")
     #     tasks_data = validated_data.pop("tasks")
 
+
+# Read-only fast path for list views: build the same dicts as the serializers above, straight from .values() rows,
+# instead of going through the field-by-field ModelSerializer machinery.
+
+
+def values_converter(model, fields, prefix=""):
+    """
+    Return the ``.values()`` names to query for some model fields, and a function converting rows
+    into the dicts a ModelSerializer would return. Only plain model fields are supported.
+    """
+    names = [prefix + f for f in fields]
+    # values the renderer would not output like the serializer fields: UUIDs, and datetimes, which the
+    # JSON encoders render in other formats (DRF's truncates microseconds, orjson's ends with +00:00)
+    converters = {}
+    for f in fields:
+        model_field = model._meta.get_field(f)
+        if isinstance(model_field, models.UUIDField):
+            converters[f] = str
+        elif isinstance(model_field, models.DateTimeField):
+            converters[f] = serializers.DateTimeField().to_representation
+
+    def convert(row):
+        data = {}
+        for field, name in zip(fields, names):
+            value = row[name]
+            if field in converters and value is not None:
+                value = converters[field](value)
+            data[field] = value
+        return data
+
+    return names, convert
+
+
+def task_rows(queryset):
+    names, convert = values_converter(Task, TaskSerializer.Meta.fields)
+    return [convert(row) for row in queryset.values(*names)]
+
+
+def archived_task_rows(queryset):
+    """
+    Return archived tasks in the same shape as ``task_rows``, with ``"archived": true``.
+
+    Their snapshots went through JSON: values are converted back like the database values,
+    and the fields added since a task was archived get their default.
+    """
+    model_fields = [Task._meta.get_field(field) for field in TaskSerializer.Meta.fields]
+    _, convert = values_converter(Task, TaskSerializer.Meta.fields)
+    rows = []
+    for data in queryset.values_list("data", flat=True):
+        values = data["fields"]
+        row = {
+            field.name: field.to_python(values[field.attname]) if field.attname in values else field.get_default()
+            for field in model_fields
+        }
+        rows.append(dict(convert(row), archived=True))
+    return rows
+
+
+def group_rows(queryset):
+    group_fields = [f for f in GroupSerializer.Meta.fields if f not in ("labels", "tasks")]
+    names, convert = values_converter(Group, group_fields)
+    groups = {}
+    for row in queryset.values(*names):
+        group = convert(row)
+        group["labels"] = []
+        group["tasks"] = []
+        groups[row["id"]] = group
+
+    names, convert = values_converter(Label, LabelSerializer.Meta.fields, prefix="label__")
+    labels = Group.labels.through.objects.filter(group_id__in=list(groups))
+    for row in labels.values("group_id", *names):
+        groups[row["group_id"]]["labels"].append(convert(row))
+
+    names, convert = values_converter(Task, TaskSerializer.Meta.fields, prefix="task__")
+    groupings = TaskGrouping.objects.filter(group_id__in=list(groups))
+    for row in groupings.values("group_id", *names):
+        groups[row["group_id"]]["tasks"].append(convert(row))
+
+    return list(groups.values())
@@ -1,19 +1,25 @@
-from .github import GitHubService
-from .stdio import StandardInputService, StandardOutputService
-from .taskhub import TaskHubService
-from .taskwarrior import TaskWarriorService
+import hashlib
+
+from ..journal import NullJournal
 
-SERVICES = {
-    srv.name: srv
-    for srv in (GitHubService, StandardInputService, StandardOutputService, TaskHubService, TaskWarriorService)
-}
+
+def get_ref(task):
+    """
+    Return the reference hash of a generic task.
+
+    Generic tasks can carry the reference of the task in the service they come from
+    in a ``ref`` attribute (a GitHub URL for example). When they don't, the task id is used.
+    """
+    ref = getattr(task, "ref", None) or str(task.id)
+    return hashlib.md5(ref.encode()).hexdigest()
 
 
 class Service:
     name = None
+    journal = NullJournal()
 
     def __init__(self, *args, **kwargs):
-        raise NotImplementedError
+        pass
 
     def read_tasks(self, *args, **kwargs):
         raise NotImplementedError
@@ -27,6 +33,24 @@ class Service:
     def write_tasks(self, tasks, *args, **kwargs):
         raise NotImplementedError
 
+    def get_groupings(self):
+        return {}
+
+    def get_ref(self, generic_task):
+        return get_ref(generic_task)
+
+
+# services import the Service base class from this package, so it must be defined before them
+from .github import GitHubService  # noqa: E402
+from .stdio import StandardInputService, StandardOutputService  # noqa: E402
+from .taskhub import TaskHubService  # noqa: E402
+from .taskwarrior import TaskWarriorService  # noqa: E402
+
+SERVICES = {
+    srv.name: srv
+    for srv in (GitHubService, StandardInputService, StandardOutputService, TaskHubService, TaskWarriorService)
+}
+
 
 __all__ = [
     "GitHubService",
@@ -1,13 +1,361 @@
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from github import Github
 
 from . import Service
+from ..timestamps import iso_to_tw
+
+USER_ISSUES = "user_issues"
+SEARCH = "search"
+
+REST = "rest"
+GRAPHQL = "graphql"
+GRAPHQL_URL = "https://api.github.com/graphql"
+API_URL = "https://api.github.com"
+
+# prefix of the descriptions of TaskWarrior tasks created from issues
+TITLE_PREFIX = "(GH) "
+
+# hidden marker in the body of the issues created from tasks, so they are found again by the next runs
+MARKER = "<!-- taskhub:{} -->"
+MARKER_RE = re.compile(r"<!-- taskhub:(\S+) -->")
+
+# only the fields used by GitHubService.to_generic_task
+GRAPHQL_FIELDS = """
+title createdAt closedAt url state
+labels(first: 20) { nodes { name } }
+repository { nameWithOwner isArchived }
+"""
+
+GRAPHQL_QUERY = """
+query($query: String!, $cursor: String) {
+  search(query: $query, type: ISSUE, first: 100, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on Issue { %(fields)s }
+      ... on PullRequest { %(fields)s }
+    }
+  }
+}
+""" % dict(fields=GRAPHQL_FIELDS)
+
+
+def split_option(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    # numeric user names are coerced to integers by the command line
+    return [item for item in str(value).split(",") if item]
+
+
+def job_key(token, job, api=REST):
+    # don't store tokens in the journal. REST and GraphQL checkpoints have different shapes, keep them apart
+    return "github:{}:{}:{}:{}".format(api, hashlib.md5(token.encode()).hexdigest(), *job)
+
+
+def fetch_pages(paginated_list, key, checkpoint):
+    items = []
+    page = 0
+    while True:
+        data = checkpoint("{}:{}".format(key, page), lambda: [item._rawData for item in paginated_list.get_page(page)])
+        if not data:
+            break
+        items.extend(data)
+        page += 1
+    return items
+
+
+def graphql_node_to_raw_data(node):
+    # same keys as the REST API payloads, as expected by GitHubService.to_generic_task
+    return dict(
+        title=node["title"],
+        created_at=node["createdAt"],
+        closed_at=node["closedAt"],
+        html_url=node["url"],
+        state=node["state"].lower(),
+        labels=[dict(name=label["name"]) for label in node["labels"]["nodes"]],
+        repository_full_name=node["repository"]["nameWithOwner"],
+        archived=node["repository"]["isArchived"],
+    )
+
+
+def fetch_graphql(token, query, key, checkpoint, url=GRAPHQL_URL):
+    items = []
+    cursor = None
+    page = 0
+
+    def fetch_page():
+        body = json.dumps(dict(query=GRAPHQL_QUERY, variables=dict(query=query, cursor=cursor))).encode()
+        request = urllib.request.Request(
+            url, data=body, headers={"Authorization": "bearer " + token, "Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:
+            payload = json.loads(response.read().decode())
+        if payload.get("errors"):
+            raise RuntimeError("GitHub GraphQL API error: {}".format(payload["errors"]))
+        search = payload["data"]["search"]
+        # nodes are empty for search results that are neither issues nor pull requests
+        nodes = [graphql_node_to_raw_data(node) for node in search["nodes"] if node]
+        next_cursor = search["pageInfo"]["endCursor"] if search["pageInfo"]["hasNextPage"] else None
+        return dict(items=nodes, cursor=next_cursor)
+
+    while True:
+        data = checkpoint("{}:{}".format(key, page), fetch_page)
+        items.extend(data["items"])
+        cursor = data["cursor"]
+        if not cursor:
+            break
+        page += 1
+
+    return [item for item in items if not item["archived"]]
+
+
+def fetch_shard(token, jobs, checkpoint=None, api=REST, graphql_url=GRAPHQL_URL):
+    """
+    Fetch the issues of a shard of jobs, with a single token.
+
+    This function runs in worker processes, so it only takes and returns picklable data.
+    When ``checkpoint`` is given, each page is checkpointed.
+
+    Returns:
+        A dictionary mapping each job to the raw data of its issues.
+    """
+    if checkpoint is None:
+
+        def checkpoint(key, compute):
+            return compute()
+
+    if api == GRAPHQL:
+        results = {}
+        for job in jobs:
+            kind, query = job
+            # the GraphQL API has no equivalent of the user issues endpoint, search them instead
+            query = "involves:@me" if kind == USER_ISSUES else query
+            results[job] = fetch_graphql(
+                token, query + " archived:false", job_key(token, job, api), checkpoint, url=graphql_url
+            )
+        return results
+
+    client = Github(token, per_page=100)
+    user = client.get_user()
+    results = {}
+
+    for job in jobs:
+        kind, query = job
+        key = job_key(token, job, api)
+
+        if kind == USER_ISSUES:
+            repos = fetch_pages(user.get_repos(), key + ":repos", checkpoint)
+            archived_repos = set(r["full_name"] for r in repos if r["archived"])
+            issues = fetch_pages(user.get_user_issues(filter="all", state="all"), key, checkpoint)
+        else:
+            archived_repos = set()
+            issues = fetch_pages(client.search_issues(query=query + " type:all archived:false"), key, checkpoint)
+
+        for issue in issues:
+            # add repository full name to raw data
+            issue["repository_full_name"] = "/".join(issue["repository_url"].split("/")[-2:])
+
+        # filter out issues from archived repositories
+        results[job] = [i for i in issues if i["repository_full_name"] not in archived_repos]
+
+    return results
+
+
+def issue_digest(payload, keys=("title", "body", "state")):
+    content = "\n".join("{}={}".format(key, payload.get(key)) for key in keys)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def marker_key(task):
+    """
+    Return the identity of a task recorded in the marker of the issue created for it, to find the issue again.
+
+    It must not change with the task: tasks use their id, dictionaries their reference, uuid or id,
+    and the title (without the prefix) when they have none of them.
+    """
+    if not isinstance(task, dict):
+        return str(task.id)
+    identity = task.get("ref") or task.get("uuid") or task.get("id")
+    if not identity:
+        title = task["description"]
+        identity = title[len(TITLE_PREFIX) :] if title.startswith(TITLE_PREFIX) else title
+    return hashlib.md5(str(identity).encode()).hexdigest()
+
+
+def with_marker(payload, key):
+    body = "{}\n\n{}".format(payload.get("body") or "", MARKER.format(key)).lstrip()
+    return dict(payload, body=body)
+
+
+class TokenBucket:
+    """
+    Pace requests: at most ``rate`` requests per second, with bursts of ``capacity`` requests.
+
+    The bucket is shared by the writer threads. Rate limit headers from GitHub responses
+    can pause it until the rate limit resets (see ``pause_until``).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause_until(self, timestamp):
+        with self.lock:
+            self.paused_until = max(self.paused_until, timestamp)
+
+    def update(self, headers):
+        # primary rate limit: wait for the reset when no requests are left
+        if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+            self.pause_until(time.monotonic() + max(0, int(headers["X-RateLimit-Reset"]) - time.time()))
+        # secondary rate limits: GitHub tells us how long to wait
+        if headers.get("Retry-After"):
+            self.pause_until(time.monotonic() + int(headers["Retry-After"]))
+
+
+def rate_limited(error):
+    # a plain 403 is a permission error, only retry the ones telling us to wait
+    if error.code == 429:
+        return True
+    return error.code == 403 and (
+        error.headers.get("X-RateLimit-Remaining") == "0" or bool(error.headers.get("Retry-After"))
+    )
+
+
+class IssueWriter:
+    """
+    Send issue writes to the GitHub REST API, paced by a token bucket, with retries and exponential backoff.
+
+    Rate limited requests are always retried: they were rejected before being processed. After server
+    and network errors, only idempotent requests are retried (see ``create_issue`` for the POST requests).
+    """
+
+    def __init__(self, token, api_url=API_URL, rate=1.0, burst=5, retries=5):
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+
+    def request(self, method, path, payload=None, retry_errors=True):
+        data = json.dumps(payload).encode() if payload is not None else None
+        headers = {"Authorization": "token " + self.token, "Accept": "application/vnd.github.v3+json"}
+        if data:
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            request = urllib.request.Request(self.api_url + path, data=data, headers=headers, method=method)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    self.bucket.update(response.headers)
+                    return json.loads(response.read().decode() or "null"), response.headers
+            except urllib.error.HTTPError as error:
+                self.bucket.update(error.headers)
+                retryable = rate_limited(error) or (retry_errors and error.code >= 500)
+                if not retryable or attempt == self.retries:
+                    raise
+            except urllib.error.URLError:
+                if not retry_errors or attempt == self.retries:
+                    raise
+            time.sleep(2 ** attempt)
+
+    def list_issues(self, repo):
+        issues = []
+        page = 1
+        while True:
+            data, _ = self.request("GET", "/repos/{}/issues?state=all&per_page=100&page={}".format(repo, page))
+            if not data:
+                break
+            issues.extend(data)
+            page += 1
+        return issues
+
+    def find_recent_issue(self, repo, marker):
+        path = "/repos/{}/issues?state=all&sort=created&direction=desc&per_page=100".format(repo)
+        data, _ = self.request("GET", path)
+        return next((issue for issue in data if marker in (issue.get("body") or "")), None)
+
+    def create_issue(self, repo, payload):
+        """
+        Create an issue.
+
+        After a server or network error, the issue may have been created anyway. It is only posted again
+        when the marker of its body (see ``with_marker``) is not found in the recent issues of the repository.
+        Without a marker, the error is raised.
+        """
+        marker = MARKER_RE.search(payload.get("body") or "")
+        for attempt in range(self.retries + 1):
+            try:
+                return self.request("POST", "/repos/{}/issues".format(repo), payload, retry_errors=False)[0]
+            except urllib.error.URLError as error:
+                server_error = not isinstance(error, urllib.error.HTTPError) or error.code >= 500
+                if not server_error or marker is None or attempt == self.retries:
+                    raise
+            time.sleep(2 ** attempt)
+            issue = self.find_recent_issue(repo, marker.group(0))
+            if issue is not None:
+                return issue
+
+    def update_issue(self, repo, number, payload):
+        return self.request("PATCH", "/repos/{}/issues/{}".format(repo, number), payload)[0]
+
+
+def parse_issue_url(url):
+    # https://github.com/owner/repo/issues/1 or https://github.com/owner/repo/pull/1
+    owner, repo, _, number = url.rstrip("/").split("/")[-4:]
+    return "{}/{}".format(owner, repo), int(number)
 
 
 class GitHubService(Service):
     """
-    
+    Read issues and pull requests from GitHub.
+
+    Options (see ``--service-option``):
+
+    - ``tokens``: comma-separated tokens, defaults to the ``GITHUB_TOKENS`` or ``GITHUB_TOKEN`` environment variable.
+      Each token is used by its own process, with its own rate limit.
+    - ``users``: comma-separated users whose authored and assigned issues are fetched.
+    - ``orgs``: comma-separated organizations whose issues are fetched.
+    - ``api``: ``rest`` (default) or ``graphql``. The GraphQL API only returns the fields we use,
+      which makes for much smaller payloads, faster to download and decode.
+    - ``graphql_url``: URL of the GraphQL API, to use a local stand-in server for example.
+
+    Writing options:
+
+    - ``repo``: the repository (``owner/name``) in which new issues are created.
+    - ``api_url``: URL of the REST API, to use a local mock API for example.
+    - ``writers``: number of concurrent writer threads (default: 4).
+    - ``rate``: maximum number of writes per second, shared by the writers (default: 1).
+
+    Tasks with a GitHub URL update the corresponding issue, other tasks create new issues in ``repo``.
+    Created issues carry a hidden marker with the task id, so that the next runs update them instead.
+    Issues that would not change are skipped.
+
+    The issues of the users owning the tokens are always fetched.
+
     Example JSON issue:
 
     .. code:: json
@@ -259,50 +607,98 @@ class GitHubService(Service):
 
     name = "github"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        users="",
+        orgs="",
+        tokens="",
+        api=REST,
+        graphql_url=GRAPHQL_URL,
+        repo=None,
+        api_url=API_URL,
+        writers=4,
+        rate=1.0,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
-        token = os.environ.get("GITHUB_TOKEN")
-        if not token:
-            raise EnvironmentError("GITHUB_TOKEN environment variable must be set.")
+        tokens = tokens or os.environ.get("GITHUB_TOKENS") or os.environ.get("GITHUB_TOKEN")
+        if not tokens:
+            raise EnvironmentError("GITHUB_TOKEN or GITHUB_TOKENS environment variable must be set.")
 
-        self.client = Github(token, per_page=100)
+        self.tokens = split_option(tokens)
+        self.users = split_option(users)
+        self.orgs = split_option(orgs)
+        self.api = api
+        self.graphql_url = graphql_url
+        self.repo = repo
+        self.api_url = api_url
+        self.writers = int(writers)
+        self.rate = float(rate)
 
-    def read_tasks(self, *args, **kwargs):
-        user = self.client.get_user()
-        pulled_issues = []
+    def get_shards(self):
+        """
+        Spread the queries across the tokens, one shard per token.
 
-        print("Gathering user repositories information...")
-        repos = list(user.get_repos())
-        archived_repos = set(r.full_name for r in repos if r.archived)
-        del repos
+        Each token fetches the issues of its own user. Searches for the configured users and orgs
+        are distributed round-robin, so that each token's rate limit is used independently.
+        """
+        shards = {
+            token: [(USER_ISSUES, None), (SEARCH, "author:@me"), (SEARCH, "assignee:@me")] for token in self.tokens
+        }
+        queries = ["author:" + user for user in self.users]
+        queries += ["assignee:" + user for user in self.users]
+        queries += ["org:" + org for org in self.orgs]
+        for index, query in enumerate(queries):
+            shards[self.tokens[index % len(self.tokens)]].append((SEARCH, query))
+        return shards
 
-        print("Gathering user issues across all repositories and organizations...")
-        pulled_issues.extend(list(user.get_user_issues(filter="all", state="all")))
+    def read_tasks(self, *args, **kwargs):
+        shards = self.get_shards()
+        pulled_issues = []
 
-        print("Gathering public issues created by user...")
-        pulled_issues.extend(list(self.client.search_issues(query="author:pawamoy type:all archived:false")))
+        if len(shards) == 1:
+            # a single shard is fetched in-process, so each page can be checkpointed
+            ((token, jobs),) = shards.items()
+            shard_results = fetch_shard(
+                token, jobs, checkpoint=self.journal.checkpoint, api=self.api, graphql_url=self.graphql_url
+            )
+            for job, results in shard_results.items():
+                pulled_issues.extend(results)
+        else:
+            # the results of jobs are checkpointed, so an interrupted run only fetches the missing ones
+            pending = {}
+            for token, jobs in shards.items():
+                for job in jobs:
+                    results = self.journal.get(job_key(token, job, self.api))
+                    if results is None:
+                        pending.setdefault(token, []).append(job)
+                    else:
+                        pulled_issues.extend(results)
 
-        print("Gathering public issues assigned to user...")
-        pulled_issues.extend(list(self.client.search_issues(query="assignee:pawamoy type:all archived:false")))
+            print("Fetching issues with {} tokens...".format(len(pending)))
+            start = time.time()
+            with ProcessPoolExecutor(max_workers=len(pending) or 1) as executor:
+                futures = {
+                    token: executor.submit(fetch_shard, token, jobs, api=self.api, graphql_url=self.graphql_url)
+                    for token, jobs in pending.items()
+                }
+                for token, future in futures.items():
+                    for job, results in future.result().items():
+                        self.journal.checkpoint(job_key(token, job, self.api), lambda: results)
+                        pulled_issues.extend(results)
+            elapsed = time.time() - start
+            print("Fetched {} issues in {:.1f}s".format(len(pulled_issues), elapsed))
 
         print("Building the unique set of issues...")
         seen = set()
         seen_add = seen.add
         issues = []
         for issue in pulled_issues:
-
-            # add repository full name to raw data
-            repository_full_name = "/".join(issue._rawData["repository_url"].split("/")[-2:])
-            issue._rawData["repository_full_name"] = repository_full_name
-
-            ref = issue._rawData["html_url"]
-
+            ref = issue["html_url"]
             if ref not in seen:
                 seen_add(ref)
-
-                # filter out issues from archived repositories
-                if repository_full_name not in archived_repos:
-                    issues.append(issue)
+                issues.append(issue)
 
         del pulled_issues
 
@@ -314,22 +710,115 @@ class GitHubService(Service):
         return tasks
 
     def to_generic_task(self, service_task):
-        project = "git." + service_task._rawData["repository_full_name"].lower().replace(".", "-").replace("/", ".")
+        project = "git." + service_task["repository_full_name"].lower().replace(".", "-").replace("/", ".")
 
-        entry = service_task._rawData["created_at"].replace("-", "").replace(":", "")
-        end = service_task._rawData["closed_at"]
+        entry = iso_to_tw(service_task["created_at"])
+        end = service_task["closed_at"]
         if end:
-            end = end.replace("-", "").replace(":", "")
+            end = iso_to_tw(end)
 
         tw_issue = dict(
-            description="(GH) " + service_task._rawData["title"].strip(),
+            description=TITLE_PREFIX + service_task["title"].strip(),
             end=end,
             entry=entry,
             project=project,
-            githuburl=service_task._rawData["html_url"],
+            githuburl=service_task["html_url"],
         )
 
         if not tw_issue["end"]:
             del tw_issue["end"]
 
         return tw_issue
+
+    def get_ref(self, generic_task):
+        return hashlib.md5(generic_task["githuburl"].encode()).hexdigest()
+
+    def to_service_task(self, generic_task):
+        if isinstance(generic_task, dict):
+            # TaskWarrior-like dictionaries, as returned by to_generic_task. They have no body: don't send one,
+            # it would wipe the body of the issue
+            title = generic_task["description"]
+            if title.startswith(TITLE_PREFIX):
+                title = title[len(TITLE_PREFIX) :]
+            payload = dict(title=title, state="closed" if generic_task.get("end") else "open")
+            url = generic_task.get("githuburl")
+        else:
+            payload = dict(
+                title=generic_task.title,
+                body=generic_task.description,
+                state="closed" if generic_task.completion_date else "open",
+            )
+            labels = getattr(generic_task, "label_titles", None)
+            if labels:
+                payload["labels"] = list(labels)
+            # tasks read from TaskWarrior carry the GitHub URL as reference, tasks read from TaskHub in extra data
+            ref = getattr(generic_task, "ref", None) or (generic_task.extra or {}).get("githuburl") or ""
+            url = ref if ref.startswith("https://github.com/") else None
+        return url, payload
+
+    def write_tasks(self, tasks, *args, **kwargs):
+        writer = IssueWriter(self.tokens[0], api_url=self.api_url, rate=self.rate, burst=self.writers)
+        writes = []
+        for task in tasks:
+            url, payload = self.to_service_task(task)
+            if not url:
+                # key recorded in the marker of the created issue, and in the journal
+                key = marker_key(task)
+                payload = with_marker(payload, key)
+            writes.append([url, payload, url or key])
+
+        print("Loading current issues...")
+        repos = {parse_issue_url(url)[0] for url, _, _ in writes if url}
+        if self.repo:
+            repos.add(self.repo)
+        issues = {}
+        created = {}
+        for repo in repos:
+            for issue in writer.list_issues(repo):
+                issues[issue["html_url"]] = issue
+                marker = MARKER_RE.search(issue.get("body") or "")
+                if marker:
+                    created[marker.group(1)] = issue["html_url"]
+
+        # tasks whose issue was created by a previous run update it
+        for entry in writes:
+            if not entry[0] and entry[2] in created:
+                entry[0] = created[entry[2]]
+
+        def write(url, payload, key):
+            if url:
+                # only the sent fields are compared
+                keys = [field for field in ("title", "body", "state") if field in payload]
+                issue = issues.get(url)
+                if issue and issue_digest(issue, keys) == issue_digest(payload, keys):
+                    return "unmodified"
+                if self.journal.applied("update", url):
+                    return "unmodified"
+                repo, number = parse_issue_url(url)
+                writer.update_issue(repo, number, payload)
+                self.journal.record("update", url)
+                return "updated"
+            if not self.repo:
+                raise ValueError("The repo option is required to create issues")
+            if self.journal.applied("create", key):
+                return "unmodified"
+            # new issues are always open, close them afterwards
+            issue = writer.create_issue(self.repo, {k: v for k, v in payload.items() if k != "state"})
+            if payload["state"] == "closed":
+                writer.update_issue(self.repo, issue["number"], dict(state="closed"))
+            self.journal.record("create", key)
+            return "created"
+
+        print("Writing {} issues with {} writers...".format(len(writes), self.writers))
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.writers) as executor:
+            results = list(executor.map(lambda w: write(*w), writes))
+        elapsed = time.time() - start
+
+        print("")
+        print("Summary")
+        print("-------")
+        print("Created     {} issues".format(results.count("created")))
+        print("Updated     {} issues".format(results.count("updated")))
+        print("Unmodified  {} issues".format(results.count("unmodified")))
+        print("Written in {:.1f}s".format(elapsed))
@@ -0,0 +1,94 @@
+"""
+Fan-in of several input services: read them concurrently and merge their tasks.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import SERVICES
+from ..journal import NullJournal
+
+
+def read_service(service):
+    start = time.time()
+    tasks = list(service.read_tasks())
+    return tasks, service.get_groupings(), time.time() - start
+
+
+def read_concurrently(input_services):
+    """
+    Read tasks from several services in threads, and merge them into one deduplicated stream.
+
+    Sources are mostly I/O bound (HTTP APIs, subprocesses, databases), so threads are enough.
+    Tasks are deduplicated on their reference (see ``Service.get_ref``): the first source wins.
+
+    Returns:
+        The merged tasks and the merged groupings (keyword arguments for ``write_tasks``).
+    """
+    with ThreadPoolExecutor(max_workers=len(input_services)) as executor:
+        results = list(executor.map(read_service, input_services))
+
+    seen = set()
+    seen_add = seen.add
+    tasks = []
+    kept_tasks = set()
+    groupings = {}
+    report = []
+
+    for service, (service_tasks, service_groupings, elapsed) in zip(input_services, results):
+        kept = 0
+        for task in service_tasks:
+            ref = service.get_ref(task)
+            if ref not in seen:
+                seen_add(ref)
+                tasks.append(task)
+                kept_tasks.add(id(task))
+                kept += 1
+        for key, values in service_groupings.items():
+            groupings.setdefault(key, []).extend(values)
+        report.append((service.name, len(service_tasks), kept, elapsed))
+
+    # drop the groupings of duplicate tasks
+    if "task_groupings" in groupings:
+        groupings["task_groupings"] = [g for g in groupings["task_groupings"] if id(g.task) in kept_tasks]
+
+    print("")
+    print("Sources")
+    print("-------")
+    for name, count, kept, elapsed in report:
+        print(
+            "{:<12} {} tasks ({} unique) in {:.1f}s, {:.0f} tasks/s".format(
+                name, count, kept, elapsed, count / elapsed if elapsed else 0
+            )
+        )
+    print("")
+
+    return tasks, groupings
+
+
+def sync(input_services_names, output_service_name, services_options=None, journal=None):
+    """
+    Read tasks from the input services and write them to the output service.
+
+    Arguments:
+        input_services_names: The names of the services to read from.
+        output_service_name: The name of the service to write to.
+        services_options: A dictionary mapping service names to their options.
+        journal: The journal used to checkpoint the run.
+    """
+    services_options = services_options or {}
+    journal = journal or NullJournal()
+
+    input_services = [SERVICES[name](**services_options.get(name, {})) for name in input_services_names]
+    output_service = SERVICES[output_service_name](**services_options.get(output_service_name, {}))
+
+    output_service.journal = journal
+    for input_service in input_services:
+        input_service.journal = journal
+
+    if len(input_services) == 1:
+        data = input_services[0].read_tasks()
+        groupings = input_services[0].get_groupings()
+    else:
+        data, groupings = read_concurrently(input_services)
+    output_service.write_tasks(data, **groupings)
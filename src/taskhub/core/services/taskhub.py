@@ -1,5 +1,321 @@
-from . import Service
+from django.conf import settings
+from django.db import transaction
+
+from . import Service, get_ref
+from ..archive import restore_task
+from ..board import invalidate_board
+from ..concurrency import bulk_update_versioned
+from ..graph import invalidate_graph
+from ..models import ArchivedTask, Group, GroupGrouping, Label, Task, TaskGrouping, TaskRef
+from ..pgcopy import copy_tasks
+from ..timestamps import parse_tw
+from ..urgency import refresh_urgency
+
+# synced fields: the manual order and the urgency are owned by TaskHub (see core.pgcopy.LOCAL_COLUMNS)
+TASK_UPDATE_FIELDS = [
+    "title",
+    "description",
+    "priority",
+    "confidential",
+    "creation_date",
+    "completion_date",
+    "last_update",
+    "status",
+    "start_date",
+    "min_duration",
+    "max_duration",
+    "due_date",
+    "expiration_date",
+    "wait_date",
+    "scheduled",
+    "recurrence",
+    "extra",
+]
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class TaskHubService(Service):
-    pass
+    """
+    Read and write tasks from/to the TaskHub database.
+
+    Generic tasks are unsaved ``Task`` instances. On top of the model fields,
+    they can carry a ``ref`` attribute (see ``get_ref``) and a ``label_titles`` attribute,
+    a list of label titles to attach to the task. The TaskWarrior-like dictionaries read from GitHub
+    are converted into such tasks (see ``to_service_task``).
+
+    Reads and writes are done in batches of ``batch_size`` rows, each write batch in its own transaction.
+    With ``copy=True``, tasks are instead streamed with PostgreSQL's ``COPY`` (see ``core.pgcopy``),
+    which is the fastest option for initial imports.
+
+    Existing tasks are only updated if they were not changed since their version was read (see ``core.concurrency``).
+    When a task was changed in the meantime, in the frontend for example, ``on_conflict`` tells what to do:
+    ``"skip"`` (the default) keeps the change, the task being updated by the next sync, and ``"retry"`` reads
+    its version again and writes it over the change (up to ``max_retries`` times), losing the concurrent edit.
+    """
+
+    name = "taskhub"
+
+    def __init__(
+        self, *args, batch_size=1000, copy=False, progress_every=100_000, on_conflict="skip", max_retries=3, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        if on_conflict not in ("retry", "skip"):
+            raise ValueError("on_conflict must be retry or skip")
+        self.batch_size = int(batch_size)
+        self.copy = copy
+        self.progress_every = int(progress_every)
+        self.on_conflict = on_conflict
+        self.max_retries = int(max_retries)
+
+    def read_tasks(self, *args, **kwargs):
+        # QuerySet.iterator() ignores prefetch_related, so we paginate on the primary key instead,
+        # prefetching labels, groupings and references once per batch
+        queryset = Task.objects.order_by("pk").prefetch_related("labels", "in_groups__group", "taskref_set")
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(page[: self.batch_size])
+            if not batch:
+                break
+            yield from batch
+            last_pk = batch[-1].pk
+
+    def to_generic_task(self, service_task):
+        return service_task
+
+    def to_service_task(self, generic_task):
+        if not isinstance(generic_task, dict):
+            return generic_task
+        # TaskWarrior-like dictionaries (see GitHubService.to_generic_task), converted like the TaskWarrior
+        # tasks they become, so that both are the same task: the issue URL is the reference
+        title, _, description = generic_task["description"].partition("\n")
+        end = generic_task.get("end")
+        task = Task(
+            title=title,
+            description=description,
+            status="completed" if end else "pending",
+            creation_date=parse_tw(generic_task["entry"]) if generic_task.get("entry") else None,
+            completion_date=parse_tw(end) if end else None,
+            extra={key: value for key, value in generic_task.items() if key not in ("description", "entry", "end")},
+        )
+        task.ref = generic_task.get("githuburl")
+        return task
+
+    def write_tasks(self, tasks, *args, **kwargs):
+        try:
+            self._write_tasks(tasks, *args, **kwargs)
+        finally:
+            # bulk writes don't send model signals: invalidate once the tasks are written, even partially,
+            # so that nothing cached while writing outlives the writes
+            invalidate_board()
+            invalidate_graph()
+
+    def _write_tasks(self, tasks, *args, groups=(), task_groupings=(), group_groupings=(), **kwargs):
+        tasks = (self.to_service_task(task) for task in tasks)
+        created_count = 0
+        updated_count = 0
+        # python ids of the generic tasks matching archived tasks, which are not written
+        self.archived = set()
+        self.conflicts = 0
+
+        print("Writing groups...")
+        for batch in batched(groups, self.batch_size):
+            with transaction.atomic():
+                Group.objects.bulk_create(batch, ignore_conflicts=True)
+        for batch in batched(group_groupings, self.batch_size):
+            with transaction.atomic():
+                GroupGrouping.objects.bulk_create(batch, ignore_conflicts=True)
+
+        if self.copy:
+            created_count, updated_count, archived_count, self.conflicts = copy_tasks(
+                tasks, task_groupings, get_ref=get_ref, progress_every=self.progress_every
+            )
+            invalidate_graph()
+            print("Computing urgencies...")
+            refresh_urgency(batch_size=self.batch_size * 10)
+            self.print_summary(created_count, updated_count, archived_count)
+            return
+
+        print("Writing tasks...")
+        for batch in batched(tasks, self.batch_size):
+            with transaction.atomic():
+                created, updated = self._write_batch(batch)
+            created_count += created
+            updated_count += updated
+            print("Written {} tasks".format(created_count + updated_count))
+
+        task_groupings = (grouping for grouping in task_groupings if id(grouping.task) not in self.archived)
+        for batch in batched(task_groupings, self.batch_size):
+            # tasks ids may have changed when matching them with existing tasks
+            for grouping in batch:
+                grouping.task_id = grouping.task.id
+            with transaction.atomic():
+                TaskGrouping.objects.bulk_create(batch, ignore_conflicts=True)
+
+        # bulk writes don't send the signals refreshing urgencies, and only changed urgencies are written.
+        # They depend on the dependency graph, which has to be reloaded with the written tasks first.
+        invalidate_graph()
+        print("Computing urgencies...")
+        refresh_urgency(batch_size=self.batch_size * 10)
+        self.print_summary(created_count, updated_count, len(self.archived))
+
+    def print_summary(self, created_count, updated_count, archived_count):
+        print("")
+        print("Summary")
+        print("-------")
+        print("Created     {} tasks".format(created_count))
+        print("Updated     {} tasks".format(updated_count))
+        print("Archived    {} tasks (skipped)".format(archived_count))
+        print("Conflicts   {} tasks (skipped)".format(self.conflicts))
+
+    def _write_batch(self, tasks):
+        refs = {}
+        # tasks sharing a reference are the same task: the most recently updated one is written
+        duplicates = []
+        for task in tasks:
+            ref = get_ref(task)
+            kept = refs.get(ref)
+            if kept is None:
+                refs[ref] = task
+            elif kept.last_update is None or (task.last_update is not None and task.last_update >= kept.last_update):
+                refs[ref] = task
+                duplicates.append((kept, ref))
+            else:
+                duplicates.append((task, ref))
+        if duplicates:
+            tasks = list(refs.values())
+
+        # match tasks with existing ones, first by reference, then by the identity keys of their extra data, then by id
+        existing_ids = dict(TaskRef.objects.filter(ref__in=refs.keys()).values_list("ref", "task_id"))
+        for ref, task_id in existing_ids.items():
+            refs[ref].id = task_id
+
+        # completed tasks that were archived are not imported again, reopened ones are restored
+        unmatched = [ref for ref in refs if ref not in existing_ids]
+        if unmatched:
+            for archived in ArchivedTask.objects.filter(refs__overlap=unmatched):
+                archived_tasks = [refs[ref] for ref in archived.refs if ref in refs]
+                if all(task.completion_date for task in archived_tasks):
+                    self.archived.update(id(task) for task in archived_tasks)
+                else:
+                    restore_task(archived)
+                    for task in archived_tasks:
+                        task.id = archived.id
+            tasks = [task for task in tasks if id(task) not in self.archived]
+            refs = {ref: task for ref, task in refs.items() if id(task) not in self.archived}
+
+        matched = {id(refs[ref]) for ref in existing_ids}
+        self._match_extra([t for t in tasks if id(t) not in matched], taken_ids=set(existing_ids.values()))
+        # the versions read here are the ones expected by the updates (see core.concurrency)
+        versions = dict(Task.objects.filter(pk__in=[t.id for t in tasks]).values_list("pk", "version"))
+
+        to_update = [t for t in tasks if t.id in versions]
+        to_create = [t for t in tasks if t.id not in versions]
+
+        if to_update:
+            skipped = self._update_tasks(to_update, versions)
+            if skipped:
+                to_update = [t for t in to_update if t.id not in skipped]
+                tasks = [t for t in tasks if t.id not in skipped]
+        if to_create:
+            Task.objects.bulk_create(to_create, batch_size=self.batch_size)
+
+        TaskRef.objects.bulk_create(
+            [TaskRef(task_id=task.id, ref=ref) for ref, task in refs.items()], ignore_conflicts=True
+        )
+
+        self._write_labels(tasks)
+
+        # so that the groupings of the duplicates point to the written task
+        for duplicate, ref in duplicates:
+            task = refs.get(ref)
+            if task is None:
+                # the task was archived instead of written
+                self.archived.add(id(duplicate))
+                continue
+            duplicate.id = task.id
+            if id(task) in self.archived:
+                self.archived.add(id(duplicate))
+
+        return len(to_create), len(to_update)
+
+    def _update_tasks(self, tasks, versions):
+        """Update tasks at their read versions, handle conflicts according to ``on_conflict``, return skipped ids."""
+        retries = self.max_retries if self.on_conflict == "retry" else 0
+        skipped = set()
+        for attempt in range(retries + 1):
+            conflicts = bulk_update_versioned(Task, tasks, TASK_UPDATE_FIELDS, versions, batch_size=self.batch_size)
+            if not conflicts:
+                break
+            if attempt == retries:
+                skipped.update(conflicts)
+                break
+            versions = dict(Task.objects.filter(pk__in=conflicts).values_list("pk", "version"))
+            # tasks deleted in the meantime are not created again
+            skipped.update(conflicts - versions.keys())
+            tasks = [t for t in tasks if t.id in versions]
+            if not tasks:
+                break
+        self.conflicts += len(skipped)
+        return skipped
+
+    def _match_extra(self, tasks, taken_ids=()):
+        """
+        Match tasks with existing ones on the identity keys of ``extra`` (the ``TASK_EXTRA_IDENTITY_KEYS`` setting),
+        return their ids.
+
+        Only non-empty strings are matched. A value shared by several tasks, new or existing, identifies none of them,
+        and existing tasks already written by the batch (``taken_ids``) are not matched again.
+        """
+        matched_ids = set()
+        for key in getattr(settings, "TASK_EXTRA_IDENTITY_KEYS", ()):
+            values = {}
+            ambiguous = set()
+            for task in tasks:
+                value = (task.extra or {}).get(key)
+                if isinstance(value, str) and value:
+                    if value in values:
+                        ambiguous.add(value)
+                    values[value] = task
+            for value in ambiguous:
+                del values[value]
+            if not values:
+                continue
+            existing = {}
+            lookup = {"extra__{}__in".format(key): list(values)}
+            for task_id, extra in Task.objects.filter(**lookup).values_list("pk", "extra"):
+                existing.setdefault(extra[key], []).append(task_id)
+            for value, task_ids in existing.items():
+                if len(task_ids) == 1 and task_ids[0] not in taken_ids and task_ids[0] not in matched_ids:
+                    values[value].id = task_ids[0]
+                    matched_ids.add(task_ids[0])
+            # the next keys only match the remaining tasks
+            tasks = [task for task in tasks if task.id not in matched_ids]
+        return matched_ids
+
+    def _write_labels(self, tasks):
+        titles = {title for t in tasks for title in getattr(t, "label_titles", ())}
+        if not titles:
+            return
+
+        labels = dict(Label.objects.filter(title__in=titles).values_list("title", "pk"))
+        missing = titles - labels.keys()
+        if missing:
+            Label.objects.bulk_create([Label(title=title, description="") for title in missing])
+            labels.update(Label.objects.filter(title__in=missing).values_list("title", "pk"))
+
+        through = Task.labels.through
+        through.objects.bulk_create(
+            [through(task_id=t.id, label_id=labels[title]) for t in tasks for title in getattr(t, "label_titles", ())],
+            ignore_conflicts=True,
+        )
@@ -1,37 +1,167 @@
+import hashlib
 import html
-from datetime import datetime
+import json
+import subprocess
+from datetime import datetime, timedelta
+from uuid import UUID, uuid5
 
 from taskw import TaskWarrior
 
 from . import Service
 from ..models import Group, GroupGrouping, Task, TaskGrouping
+from ..timestamps import TW_FORMAT, UTC, iso_to_tw, memoized, parse_tw
+
+PROJECTS_NAMESPACE = UUID("5b9a7c2e-3f0d-4f8e-9a51-6f1d2c7e8b40")
+
+# user defined attributes storing the content hash of synced tasks and the time they were last written,
+# declare them with: task config uda.taskhubhash.type string; task config uda.taskhubsynced.type string
+HASH_UDA = "taskhubhash"
+SYNCED_UDA = "taskhubsynced"
+
+# TaskWarrior stamps its own modification time when a task is written, a bit after the time stored in SYNCED_UDA:
+# tasks modified later than this were edited locally
+WRITE_SLACK = timedelta(seconds=10)
+
+# TaskWarrior priorities in TaskHub's 0-99 scale, giving the same urgency terms (see core.urgency)
+PRIORITIES = {"H": 99, "M": 82, "L": 65}
+
+# TaskWarrior date attributes and the matching task fields
+DATES = {
+    "due": "due_date",
+    "scheduled": "scheduled",
+    "wait": "wait_date",
+    "start": "start_date",
+    "until": "expiration_date",
+}
+
+# attributes mapped to task fields, or internal to TaskWarrior: the other ones (project, UDAs such as githuburl,
+# annotations...) are kept in the extra data of the tasks
+MAPPED = {"uuid", "id", "description", "status", "entry", "modified", "end", "priority", "tags", "urgency"}
+INTERNAL = {HASH_UDA, SYNCED_UDA, "mask", "imask", "parent"}
+
+
+# synced tasks, deleted ones are left out
+STATUS_FILTER = ("(", "status:pending", "or", "status:completed", ")")
+
+
+def content_hash(service_task):
+    content = "\n".join("{}={}".format(key, service_task[key]) for key in sorted(service_task))
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def fix_tw_encoding(string):
+    # the data files read by taskw escape quotes and brackets with TaskWarrior's own entities
+    return html.unescape(
+        string.replace("&dquot;", "&quot;").replace("&open;", "&lbrack;").replace("&close;", "&rbrack;")
+    )
+
+
+def parse_date(value):
+    # task export prints dates in the basic ISO 8601 format, the data files read by taskw hold epoch timestamps
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), UTC)
+    return parse_tw(value)
+
+
+def export_tasks(*filters):
+    """
+    Stream the tasks matching the given filters with a single ``task export`` run.
+
+    With ``json.array=off``, TaskWarrior prints one JSON task per line,
+    so tasks are decoded one by one as they come instead of loading the whole export at once.
+    """
+    command = ["task", "rc.hooks=off", "rc.verbose=nothing", "rc.json.array=off", *filters, "export"]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True) as process:
+        for line in process.stdout:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def count_tasks(*filters):
+    """Return the number of tasks matching the given filters, with a single ``task count`` run."""
+    command = ["task", "rc.hooks=off", "rc.verbose=nothing", *filters, "count"]
+    return int(subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.strip())
+
+
+class ProjectGroups:
+    """
+    Intern TaskWarrior project paths (``a.b.c``) into a hierarchy of groups.
+
+    Each project node is created once per run, with an id derived from its path,
+    so that the same project always maps to the same group across runs.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.group_groupings = []
+
+    def get(self, project):
+        group = self.groups.get(project)
+        if group is None:
+            parent, _, title = project.rpartition(".")
+            group = Group(id=uuid5(PROJECTS_NAMESPACE, project), title="Project " + title, description="")
+            self.groups[project] = group
+            if parent:
+                self.group_groupings.append(GroupGrouping(group=group, in_group=self.get(parent), order=1))
+        return group
 
 
 class TaskWarriorService(Service):
-    def __init__(self, *args, **kwargs):
+    """
+    Read and write tasks from/to TaskWarrior.
+
+    With the default ``reader="export"``, tasks are loaded with one filtered ``task export`` run,
+    and only the tasks carrying the key UDA are loaded when syncing. ``reader="taskw"`` loads
+    every pending and completed task through the ``taskw`` client instead.
+    """
+
+    name = "taskwarrior"
+
+    def __init__(self, *args, reader="export", **kwargs):
         super().__init__(*args, **kwargs)
         self.client = TaskWarrior()
+        self.reader = reader
+        self.projects = ProjectGroups()
+        self.task_groupings = []
+        self.parse_date = memoized(parse_date)
+
+    def load_tasks(self, *filters):
+        if self.reader == "export":
+            return export_tasks(*STATUS_FILTER, *filters)
+        tw_tasks = self.client.load_tasks()
+        tasks = tw_tasks["pending"] + tw_tasks["completed"]
+        for task in tasks:
+            task["description"] = fix_tw_encoding(task["description"])
+        return tasks
+
+    def read_tasks(self, *args, **kwargs):
+        tasks = []
+        for service_task in self.load_tasks():
+            task, groupings = self.to_generic_task(service_task)
+            tasks.append(task)
+            self.task_groupings.extend(groupings)
+        return tasks
+
+    def get_groupings(self):
+        return dict(
+            groups=list(self.projects.groups.values()),
+            task_groupings=self.task_groupings,
+            group_groupings=self.projects.group_groupings,
+        )
 
     def to_generic_task(self, service_task):
-        def str_to_date(d):
-            return datetime(
-                year=int(d[:4]),
-                month=int(d[4:6]),
-                day=int(d[6:8]),
-                hour=int(d[9:11]),
-                minute=int(d[11:13]),
-                second=int(d[13:15]),
-            )
-
-        creation_date = str_to_date(service_task["entry"])
+        creation_date = self.parse_date(service_task["entry"])
 
         last_updated = None
         if "modified" in service_task:
-            last_updated = str_to_date(service_task["modified"])
+            last_updated = self.parse_date(service_task["modified"])
 
         completion_date = None
         if "end" in service_task:
-            completion_date = str_to_date(service_task["end"])
+            completion_date = self.parse_date(service_task["end"])
 
         title_description = service_task["description"].split("\n", 1)
         if len(title_description) > 1:
@@ -43,17 +173,6 @@ class TaskWarriorService(Service):
         status = service_task["status"]
         uuid = service_task["uuid"]
 
-        groups = {}
-        group = None
-        if "project" in service_task:
-            previous_group = None
-            for group in service_task["project"].split("."):
-                if group not in groups:
-                    groups[group] = Group(title="Project " + group)
-                if previous_group:
-                    GroupGrouping(group=groups[group], in_group=previous_group, order=1)
-                previous_group = groups[group]
-
         task = Task(
             id=uuid,
             status=status,
@@ -62,62 +181,43 @@ class TaskWarriorService(Service):
             completion_date=completion_date,
             creation_date=creation_date,
             last_update=last_updated,
+            priority=PRIORITIES.get(service_task.get("priority"), 50),
+            extra={
+                attr: value
+                for attr, value in service_task.items()
+                if attr not in MAPPED and attr not in INTERNAL and attr not in DATES
+            },
+            **{field: self.parse_date(service_task[attr]) for attr, field in DATES.items() if attr in service_task}
         )
-        if group:
-            TaskGrouping(task=task, group=groups[group], order=1)
+        task.label_titles = service_task.get("tags", [])
+        if "githuburl" in service_task:
+            # same reference as the issue read from GitHub (see GitHubService.get_ref), so they are deduplicated
+            task.ref = service_task["githuburl"]
 
-    def to_service_task(self, generic_task):
-        project = "git." + generic_task._rawData["repository_full_name"].lower().replace(".", "-").replace("/", ".")
-        # labels=[l['name'] for l in issue._rawData['labels']]
-        # tags=''
-        # if labels:
-        #     tags='+' + ' +'.join(labels)
-
-        entry = generic_task._rawData["created_at"].replace("-", "").replace(":", "")
-        end = generic_task._rawData["closed_at"]
-        if end:
-            end = end.replace("-", "").replace(":", "")
-
-        tw_issue = dict(
-            # depends
-            description="(GH) " + generic_task._rawData["title"].strip(),
-            # due
-            end=end,
-            entry=entry,
-            # id
-            # imask
-            # mask
-            # modified
-            # parent
-            # priority
-            project=project,
-            # recur
-            # scheduled
-            # start
-            # status
-            # tags=tags,
-            # until
-            # urgency
-            # uuid
-            # wait
-            githuburl=generic_task._rawData["html_url"],
-        )
+        groupings = []
+        if "project" in service_task:
+            groupings.append(TaskGrouping(task=task, group=self.projects.get(service_task["project"]), order=1))
 
-        return tw_issue
+        return task, groupings
 
-    def fix_tw_encoding(self, string):
-        return html.unescape(
-            string.replace("&dquot;", "&quot;").replace("&open;", "&lbrack;").replace("&close;", "&rbrack;")
-        )
+    def to_service_task(self, generic_task):
+        # generic tasks written to TaskWarrior are TaskWarrior-like dictionaries (see GitHubService.to_generic_task),
+        # copied so that the digests added in write_tasks don't leak into the input tasks
+        return dict(generic_task)
 
     def changed(self, new_task, old_task):
-        reduced_task = {key: old_task[key] for key in new_task.keys() if key in old_task}
-
-        reduced_task["description"] = self.fix_tw_encoding(reduced_task["description"])
-
-        if reduced_task != new_task:
+        # new tasks are hashed once in write_tasks, and the hash is stored in the TaskWarrior task when written,
+        # so a different digest means the source changed. Tasks written before hashes existed are updated once.
+        if old_task.get(HASH_UDA) != new_task[HASH_UDA] or SYNCED_UDA not in old_task:
             return True
-        return False
+        # tasks modified after they were written were edited locally, and are written again
+        synced = self.parse_date(old_task[SYNCED_UDA])
+        return self.parse_date(old_task.get("modified", old_task[SYNCED_UDA])) > synced + WRITE_SLACK
+
+    def synced(self, task):
+        """Record in a task to write the time it is written at (see ``changed``)."""
+        task[SYNCED_UDA] = datetime.now(UTC).strftime(TW_FORMAT)
+        return task
 
     def map_tasks(self, new_tasks, old_tasks):
         mapping = dict(matched=[], new=[], kept=[])
@@ -157,8 +257,8 @@ class TaskWarriorService(Service):
 
     def write_tasks(self, tasks, *args, **kwargs):
         print("Loading taskwarrior tasks...")
-        tw_tasks = self.client.load_tasks()
-        tw_tasks = tw_tasks["pending"] + tw_tasks["completed"]
+        # only tasks with the key UDA can be matched, other tasks are kept anyway
+        tw_tasks = self.load_tasks("githuburl.any:")
 
         untouched_count = 0
         updated_count = 0
@@ -166,8 +266,13 @@ class TaskWarriorService(Service):
         closed_count = 0
         logged_count = 0
 
+        tasks = [self.to_service_task(task) for task in tasks]
+        for task in tasks:
+            task[HASH_UDA] = content_hash(task)
+
         print("Mapping issues to existing tasks...")
-        mapping = self.map_tasks(tasks, tw_tasks)
+        # the mapping is checkpointed: when resuming a run, writes already applied are skipped below
+        mapping = self.journal.checkpoint("taskwarrior:mapping", lambda: self.map_tasks(tasks, tw_tasks))
 
         print("All done. Starting to apply changes!")
         print("")
@@ -178,9 +283,11 @@ class TaskWarriorService(Service):
         print("")
 
         for issue, task in mapping["matched"]:
+            if self.journal.applied("update", issue["githuburl"]):
+                continue
             if self.changed(issue, task):
                 task.update(issue)
-                _, task = self.client.task_update(task)
+                _, task = self.client.task_update(self.synced(task))
                 if "end" in task and task["end"] and task["status"] == "pending":
                     self.client.task_done(uuid=task["uuid"])
                     closed_count += 1
@@ -188,6 +295,7 @@ class TaskWarriorService(Service):
                 else:
                     updated_count += 1
                     print("Updated task {}".format(task))
+                self.journal.record("update", issue["githuburl"])
             else:
                 untouched_count += 1
 
@@ -197,7 +305,9 @@ class TaskWarriorService(Service):
         print("")
 
         for task in mapping["new"]:
-            task = self.client.task_add(**task)
+            if self.journal.applied("add", task["githuburl"]):
+                continue
+            task = self.client.task_add(**self.synced(task))
             if "end" in task and task["end"]:
                 self.client.task_done(uuid=task["uuid"])
                 logged_count += 1
@@ -205,6 +315,7 @@ class TaskWarriorService(Service):
             else:
                 created_count += 1
                 print("Created task {}".format(task))
+            self.journal.record("add", task["githuburl"])
 
         print("")
         print("Deleting tasks")
@@ -212,10 +323,17 @@ class TaskWarriorService(Service):
         print("")
 
         deleted_count = len(mapping["unmatched"])
-        kept_count = len(mapping["kept"])
+        if self.reader == "export":
+            # tasks without the key UDA were not loaded
+            kept_count = count_tasks(*STATUS_FILTER, "githuburl.none:")
+        else:
+            kept_count = len(mapping["kept"])
 
         for task in mapping["unmatched"]:
+            if self.journal.applied("delete", task["uuid"]):
+                continue
             self.client.task_delete(uuid=task["uuid"])
+            self.journal.record("delete", task["uuid"])
             print("Deleted task {}".format(task))
 
         print("")
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.routers.PrimaryPinningMiddleware",
 ]
 
 CORS_ORIGIN_WHITELIST = (
@@ -91,9 +92,60 @@ DATABASES = {
         "PASSWORD": os.getenv("TASKHUB_DB_PASSWORD"),
         "HOST": os.getenv("TASKHUB_DB_HOST", "taskhub_db"),
         "PORT": os.getenv("TASKHUB_DB_PORT", "5432"),
+        # persistent connections, reused by the requests of each worker thread; set to 0 to disable.
+        # Django checks them at the start and end of each request and drops unusable ones.
+        "CONN_MAX_AGE": int(os.getenv("TASKHUB_DB_CONN_MAX_AGE", "60")),
     }
 }
 
+# Read replicas, as comma-separated HOST[:PORT] values, sharing the credentials of the default database.
+# Safe requests on the API read from them, see core.routers.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv("TASKHUB_DB_REPLICAS", "").split(",")), 1):
+    host, _, port = replica.partition(":")
+    alias = "replica%d" % index
+    DATABASES[alias] = dict(DATABASES["default"], HOST=host, PORT=port or DATABASES["default"]["PORT"])
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+# Replicas lagging more than this number of seconds are not used.
+REPLICA_MAX_LAG = float(os.getenv("TASKHUB_REPLICA_MAX_LAG", "5"))
+
+# Clients read from the primary database for this number of seconds after writing.
+READ_YOUR_WRITES_WINDOW = int(os.getenv("TASKHUB_READ_YOUR_WRITES_WINDOW", "10"))
+
+
+# Cache, local to each process by default: set TASKHUB_CACHE_LOCATION (memcached host:port) to share it between workers.
+# Cached boards are keyed by generations stored in the database (see core.generations), so a local cache
+# is never stale, only computed once per process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache"
+        if os.getenv("TASKHUB_CACHE_LOCATION")
+        else "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": os.getenv("TASKHUB_CACHE_LOCATION", "taskhub"),
+    }
+}
+
+# Boards are invalidated when tasks change, the timeout only bounds the staleness of replica reads
+BOARD_CACHE_TIMEOUT = int(os.getenv("TASKHUB_BOARD_CACHE_TIMEOUT", "300"))
+BOARD_MAX_TASKS = 100
+
+# Archived tasks listed after the tasks with include_archived=true, by default and at most
+ARCHIVED_PAGE_SIZE = 100
+ARCHIVED_PAGE_MAX = 1000
+
+# Hot keys of Task.extra, indexed for lookups, with their type: "string", "number" or "boolean" (see core.extra)
+TASK_EXTRA_INDEXES = {"githuburl": "string"}
+
+# Keys of Task.extra identifying a task in every service (string values): synced tasks without a known reference
+# are matched with the existing task having the same value. They should be indexed in TASK_EXTRA_INDEXES.
+TASK_EXTRA_IDENTITY_KEYS = ["githuburl"]
+
+# Titles of the relationships (Rel) making a task wait for another: "task1 blocks task2", "task1 depends on task2"
+DEPENDENCY_RELS = {"blocks": ["blocks"], "depends_on": ["depends on", "blocked by"]}
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -133,5 +185,12 @@ REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     # "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"]
-    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"]
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    # orjson-based, they fall back to the standard JSON renderer and parser when orjson is not installed
+    "DEFAULT_RENDERER_CLASSES": ["core.renderers.ORJSONRenderer", "rest_framework.renderers.BrowsableAPIRenderer"],
+    "DEFAULT_PARSER_CLASSES": [
+        "core.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
@@ -0,0 +1,49 @@
+"""
+Parsing and formatting of the timestamps used by the services.
+
+TaskWarrior stores UTC timestamps in the basic ISO 8601 format (``20190102T030405Z``),
+GitHub uses the extended format (``2019-01-02T03:04:05Z``). Both are fixed-width,
+so we parse them by slicing, which is several times faster than ``datetime.strptime``.
+
+Parsed datetimes are timezone-aware (UTC), as expected by Django with ``USE_TZ = True``.
+"""
+
+from datetime import datetime, timezone
+
+UTC = timezone.utc
+TW_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def parse_tw(value):
+    return datetime(
+        int(value[:4]), int(value[4:6]), int(value[6:8]), int(value[9:11]), int(value[11:13]), int(value[13:15]), 0, UTC
+    )
+
+
+def iso_to_tw(value):
+    # two chained str.replace calls measure faster than slicing or str.translate here
+    return value.replace("-", "").replace(":", "")
+
+
+def memoized(parse):
+    """
+    Return a version of ``parse`` that remembers its results.
+
+    Synced tasks often share timestamps (bulk edits, imports), so parsing a whole
+    column through a memoized parser skips most of the work. Use one per run.
+    """
+    cache = {}
+
+    def parse_memoized(value):
+        try:
+            return cache[value]
+        except KeyError:
+            result = cache[value] = parse(value)
+            return result
+
+    return parse_memoized
+
+
+def parse_column(values, parse=parse_tw):
+    parse = memoized(parse)
+    return [None if value is None else parse(value) for value in values]
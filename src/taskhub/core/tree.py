@@ -0,0 +1,97 @@
+"""
+Nested tree of groups (see ``GroupGrouping``), built from two queries.
+
+All the groups and all the groupings are loaded at once, then the tree is assembled in memory with an iterative
+depth-first walk, so it takes time linear in the size of the resulting tree, whatever its depth.
+A group which is an ancestor of itself is listed once more with ``"cycle": true`` and no children,
+so cycles in the data cannot make the walk loop forever.
+"""
+
+from django.db.models import Count
+
+from .models import Group, GroupGrouping
+
+
+def build_tree(root=None, max_depth=None, counts=False):
+    """
+    Build the nested tree of groups.
+
+    Arguments:
+        root: The id of the group to use as the root, instead of every group without a parent.
+        max_depth: The maximum depth of the nodes to list (the roots are at depth 0).
+            Nodes whose children are cut off are marked with ``"truncated": true``.
+        counts: Whether to add the number of tasks directly in each group (``task_count``).
+
+    Returns:
+        A list of root nodes, each one a dictionary with the group ``id``, ``title`` and ``children``.
+
+    Raises:
+        Group.DoesNotExist: When the root group does not exist.
+    """
+    groups = Group.objects.values("id", "title")
+    if counts:
+        groups = groups.annotate(task_count=Count("has_tasks"))
+    nodes = {group["id"]: group for group in groups}
+
+    children = {}
+    has_parent = set()
+    for in_group_id, group_id in GroupGrouping.objects.order_by("in_group_id", "order", "pk").values_list(
+        "in_group_id", "group_id"
+    ):
+        children.setdefault(in_group_id, []).append(group_id)
+        has_parent.add(group_id)
+
+    if root is not None:
+        if root not in nodes:
+            raise Group.DoesNotExist
+        roots = [root]
+    else:
+        by_title = sorted(nodes, key=lambda i: nodes[i]["title"])
+        roots = [i for i in by_title if i not in has_parent]
+        # groups whose ancestors are all inside a cycle are not reachable from a group without parent:
+        # the first one of each such component becomes a root as well
+        reached = set()
+        for group_id in roots + by_title:
+            if group_id in reached:
+                continue
+            if group_id in has_parent:
+                roots.append(group_id)
+            pending = [group_id]
+            reached.add(group_id)
+            while pending:
+                for child_id in children.get(pending.pop(), ()):
+                    if child_id not in reached:
+                        reached.add(child_id)
+                        pending.append(child_id)
+
+    def new_node(group_id, depth):
+        node = dict(nodes[group_id], children=[])
+        if max_depth is not None and depth >= max_depth and children.get(group_id):
+            node["truncated"] = True
+        return node
+
+    tree = []
+    for root_id in roots:
+        root_node = new_node(root_id, 0)
+        tree.append(root_node)
+        if "truncated" in root_node:
+            continue
+        path = {root_id}
+        stack = [(root_node, root_id, 0, iter(children.get(root_id, ())))]
+        while stack:
+            node, group_id, depth, child_ids = stack[-1]
+            child_id = next(child_ids, None)
+            if child_id is None:
+                stack.pop()
+                path.discard(group_id)
+                continue
+            child = new_node(child_id, depth + 1)
+            node["children"].append(child)
+            if child_id in path:
+                child["cycle"] = True
+                child.pop("truncated", None)
+            elif "truncated" not in child:
+                path.add(child_id)
+                stack.append((child, child_id, depth + 1, iter(children.get(child_id, ()))))
+
+    return tree
@@ -0,0 +1,194 @@
+"""
+Urgency of tasks, in the style of TaskWarrior.
+
+The urgency of a task is a sum of terms, each one a coefficient (see the ``URGENCY_COEFFICIENTS`` setting)
+multiplied by a factor between -1 and 1: priority, due date, age, labels, whether the task is active,
+scheduled, waiting, blocked or blocking other tasks. Completed tasks have an urgency of 0.
+
+Urgencies are computed in batches with NumPy, over the columns of the tasks pulled with ``values_list``,
+and stored in the indexed ``Task.urgency`` column, so tasks can be ordered by urgency in the database.
+Since the date terms drift with time, ``manage.py refresh_urgency`` must run periodically:
+only the tasks whose urgency changed are written.
+"""
+
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .graph import get_graph
+from .models import Task
+from .timestamps import UTC
+
+DAY = 86400
+
+# same coefficients as TaskWarrior
+DEFAULT_COEFFICIENTS = {
+    "priority": 6.0,
+    "due": 12.0,
+    "age": 2.0,
+    "age_max_days": 365,
+    "labels": 1.0,
+    "active": 4.0,
+    "scheduled": 5.0,
+    "waiting": -3.0,
+    "blocked": -5.0,
+    "blocking": 8.0,
+}
+
+COLUMNS = ["id", "priority", "creation_date", "due_date", "start_date", "scheduled", "wait_date", "completion_date"]
+
+
+def get_coefficients():
+    return dict(DEFAULT_COEFFICIENTS, **getattr(settings, "URGENCY_COEFFICIENTS", {}))
+
+
+def timestamps(dates):
+    """Convert a sequence of datetimes (or None) to an array of timestamps (or NaN)."""
+    return np.array([d.timestamp() if d is not None else np.nan for d in dates], dtype=np.float64)
+
+
+def compute_urgency(columns, now, coefficients=None):
+    """
+    Compute the urgency of a batch of tasks.
+
+    Arguments:
+        columns: A dictionary of arrays: ``priority`` (0 to 99, 50 being the default), the timestamps
+            of the ``COLUMNS`` dates (NaN when missing), and the ``labels``, ``blocked`` and ``blocking`` counts.
+        now: The current timestamp.
+        coefficients: The coefficients of the terms, ``get_coefficients()`` by default.
+
+    Returns:
+        An array of urgencies, rounded to 2 decimals.
+    """
+    c = coefficients or get_coefficients()
+
+    with np.errstate(invalid="ignore"):
+        # TaskWarrior's H, M and L priorities map to 99, 82 and 65
+        urgency = c["priority"] * (columns["priority"] - 50) / 49
+
+        # from 0.2 two weeks before the due date to 1 one week after, linearly
+        overdue_days = (now - columns["due_date"]) / DAY
+        due = np.clip((overdue_days + 14) * 0.8 / 21 + 0.2, 0.2, 1)
+        urgency += c["due"] * np.where(np.isnan(overdue_days), 0, due)
+
+        age_days = (now - columns["creation_date"]) / DAY
+        urgency += c["age"] * np.where(np.isnan(age_days), 0, np.clip(age_days / c["age_max_days"], 0, 1))
+
+        labels = columns["labels"]
+        urgency += c["labels"] * np.select([labels >= 3, labels == 2, labels == 1], [1.0, 0.9, 0.8], 0)
+
+        urgency += c["active"] * (columns["start_date"] <= now)
+        urgency += c["scheduled"] * (columns["scheduled"] <= now)
+        urgency += c["waiting"] * (columns["wait_date"] > now)
+        urgency += c["blocked"] * (columns["blocked"] > 0)
+        urgency += c["blocking"] * (columns["blocking"] > 0)
+
+    urgency[~np.isnan(columns["completion_date"])] = 0
+    return np.round(urgency, 2)
+
+
+def to_columns(rows, blocked, blocking):
+    """Convert ``COLUMNS`` + label count rows to the arrays expected by ``compute_urgency``."""
+    ids, priorities, *dates, labels = zip(*rows)
+    columns = {name: timestamps(values) for name, values in zip(COLUMNS[2:], dates)}
+    columns["priority"] = np.array(priorities, dtype=np.float64)
+    columns["labels"] = np.array(labels, dtype=np.int64)
+    columns["blocked"] = np.array([task_id in blocked for task_id in ids], dtype=np.int8)
+    columns["blocking"] = np.array([task_id in blocking for task_id in ids], dtype=np.int8)
+    return ids, columns
+
+
+def refresh_urgency(queryset=None, batch_size=10_000, progress=True, flags=None):
+    """
+    Compute the urgency of tasks and store the ones that changed.
+
+    Arguments:
+        queryset: The tasks to refresh, all of them by default.
+        batch_size: The number of tasks computed at once.
+        progress: Whether to print progress.
+        flags: The sets of blocked and blocking task ids, at least for the refreshed tasks.
+            By default, they are computed over the whole graph.
+
+    Returns:
+        The number of updated tasks.
+    """
+    queryset = (Task.objects.all() if queryset is None else queryset).order_by("pk")
+    queryset = queryset.annotate(label_count=Count("labels")).values_list(*COLUMNS, "label_count", "urgency")
+    if flags is None:
+        graph = get_graph()
+        flags = set(graph.blocked()), set(graph.blocking())
+    blocked, blocking = flags
+    coefficients = get_coefficients()
+    now = datetime.now(UTC).timestamp()
+
+    start = time.time()
+    computed = updated = 0
+    last_pk = None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(page[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        ids, columns = to_columns([row[:-1] for row in rows], blocked, blocking)
+        urgencies = compute_urgency(columns, now, coefficients)
+        changed = [
+            Task(id=task_id, urgency=float(urgency))
+            for task_id, urgency, row in zip(ids, urgencies, rows)
+            if urgency != row[-1]
+        ]
+        if changed:
+            with transaction.atomic():
+                Task.objects.bulk_update(changed, ["urgency"], batch_size=1000)
+
+        computed += len(rows)
+        updated += len(changed)
+        if progress:
+            print("Computed {} urgencies, updated {}".format(computed, updated))
+
+    if progress:
+        elapsed = time.time() - start
+        print(
+            "Computed {} urgencies in {:.1f}s ({:.0f} tasks/s)".format(
+                computed, elapsed, computed / elapsed if elapsed else 0
+            )
+        )
+    return updated
+
+
+def refresh_tasks(task_ids, graph=None):
+    """Refresh the urgency of a few tasks, looking only at their own dependencies in the graph."""
+    flags = (graph or get_graph()).flags(task_ids)
+    refresh_urgency(Task.objects.filter(pk__in=task_ids), progress=False, flags=flags)
+
+
+def refresh_on_commit(task_ids):
+    transaction.on_commit(lambda: refresh_tasks(task_ids))
+
+
+def task_saved(sender, instance, **kwargs):
+    task_id = instance.pk
+
+    def refresh():
+        # completing or reopening a task may block or unblock the tasks waiting for it,
+        # and change whether the tasks it waits for are blocking
+        graph = get_graph()
+        refresh_tasks([task_id] + graph.neighbors(task_id), graph)
+
+    transaction.on_commit(refresh)
+
+
+def task_labels_changed(sender, instance, action, pk_set, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        # when the labels are changed from the label side, pk_set contains the tasks
+        refresh_on_commit([instance.pk] if isinstance(instance, Task) else list(pk_set or ()))
+
+
+def task_rel_changed(sender, instance, **kwargs):
+    # the tasks may have become blocked or blocking
+    refresh_on_commit([instance.task1_id, instance.task2_id])
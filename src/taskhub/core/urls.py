@@ -26,6 +26,8 @@ router.register(r"users", views.UserViewSet)
 router.register(r"tasks", views.TaskViewSet)
 router.register(r"groups", views.GroupViewSet)
 router.register(r"labels", views.LabelViewSet)
+router.register(r"archived-tasks", views.ArchivedTaskViewSet)
+router.register(r"sync-jobs", views.SyncJobViewSet)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -1,25 +1,320 @@
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import viewsets
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
+from rest_framework.response import Response
+
+from .archive import restore_task
+from .board import get_board
+from .extra import extra_filters
+from .graph import get_graph
+from .models import ArchivedTask, Group, Label, SyncJob, Task, VersionConflict
+from .ordering import move
+from .recurrence import expand, materialize
+from .routers import is_pinned, reading_from_replicas
+from .serializers import (
+    ArchivedTaskSerializer,
+    UserSerializer,
+    TaskSerializer,
+    GroupSerializer,
+    GroupingMoveSerializer,
+    LabelSerializer,
+    MoveSerializer,
+    OccurrenceSerializer,
+    WindowSerializer,
+    SyncJobSerializer,
+    archived_task_rows,
+    group_rows,
+    task_rows,
+)
+from .tree import build_tree
+
+
+class ReplicaReadMixin:
+    """Serve safe requests from the read replicas, unless the client recently wrote something."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with reading_from_replicas(request.method in SAFE_METHODS and not is_pinned(request)):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class Conflict(APIException):
+    status_code = 409
+    default_detail = "The object was changed in the meantime."
+    default_code = "conflict"
+
+
+class VersionMixin:
+    """
+    Optimistic concurrency (see ``models.Versioned``): to update or delete an object, clients send the version
+    they read, in an ``If-Match`` header (as returned in the ``ETag`` header) or in the ``version`` field.
+    If the object was changed in the meantime, they get a 409 Conflict with its current version,
+    instead of silently overwriting the change. Without a version, the last write wins.
+    """
+
+    def get_expected_version(self):
+        value = self.request.META.get("HTTP_IF_MATCH") or self.request.data.get("version")
+        if value is None or value in ("", "*"):
+            return None
+        try:
+            return int(str(value).strip('W/"'))
+        except ValueError:
+            raise ValidationError({"version": "A valid integer is required."})
+
+    def conflict(self, instance):
+        version = type(instance).objects.filter(pk=instance.pk).values_list("version", flat=True).first()
+        return Conflict({"detail": Conflict.default_detail, "version": version})
+
+    def with_etag(self, response):
+        if isinstance(response.data, dict) and "version" in response.data:
+            response["ETag"] = '"{}"'.format(response.data["version"])
+        return response
 
-from .models import Group, Label, Task
-from .serializers import UserSerializer, TaskSerializer, GroupSerializer, LabelSerializer
+    def retrieve(self, request, *args, **kwargs):
+        return self.with_etag(super().retrieve(request, *args, **kwargs))
 
+    def update(self, request, *args, **kwargs):
+        return self.with_etag(super().update(request, *args, **kwargs))
 
-class GroupViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        expected_version = self.get_expected_version()
+        if expected_version is not None:
+            serializer.instance.version = expected_version
+        try:
+            serializer.save()
+        except VersionConflict:
+            raise self.conflict(serializer.instance)
+
+    def perform_destroy(self, instance):
+        expected_version = self.get_expected_version()
+        if expected_version is None:
+            instance.delete()
+        elif not type(instance).objects.filter(pk=instance.pk, version=expected_version).delete()[0]:
+            raise self.conflict(instance)
+
+
+class ValuesListMixin:
+    """
+    Build list responses straight from ``.values()`` rows with ``values_rows`` (see ``serializers.task_rows``),
+    skipping the serializer. Paginated lists still go through the serializer.
+    """
+
+    values_rows = None
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        return Response(self.values_rows(self.filter_queryset(self.get_queryset())))
+
+
+class ExtraFilter(BaseFilterBackend):
+    """Filter tasks on the hot keys of their extra data (``?extra__githuburl=...``), see ``core.extra``."""
+
+    def filter_queryset(self, request, queryset, view):
+        try:
+            return queryset.filter(**extra_filters(request.query_params))
+        except ValueError as error:
+            raise ValidationError(str(error))
+
+
+class GroupViewSet(ReplicaReadMixin, VersionMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
+    values_rows = staticmethod(group_rows)
+
+    @action(detail=False)
+    def tree(self, request):
+        """
+        The nested tree of groups, ordered by position.
 
+        Query parameters: ``root`` (a group id, to get a subtree), ``depth`` (maximum depth)
+        and ``counts`` (add the number of tasks of each group).
+        """
+        params = request.query_params
+        try:
+            root = uuid.UUID(params["root"]) if params.get("root") else None
+            max_depth = int(params["depth"]) if params.get("depth") else None
+        except ValueError:
+            raise ValidationError("root must be a group id and depth an integer")
+        try:
+            tree = build_tree(root, max_depth, counts=params.get("counts") in ("1", "true"))
+        except Group.DoesNotExist:
+            raise NotFound("No such group")
+        return Response(tree)
 
-class UserViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=["post"], url_path="move-task")
+    def move_task(self, request, pk=None):
+        """Move a task of the group (``{"item": id, "after": id, "before": id}``, task ids) among its tasks."""
+        return self.move_item(self.get_object().has_tasks.all(), "task_id", request.data)
+
+    @action(detail=True, methods=["post"], url_path="move-group")
+    def move_group(self, request, pk=None):
+        """Move a subgroup of the group (``{"item": id, "after": id, "before": id}``, group ids) among its subgroups."""
+        return self.move_item(self.get_object().has_groups.all(), "group_id", request.data)
+
+    def move_item(self, groupings, column, data):
+        serializer = GroupingMoveSerializer(data=data, context={"groupings": groupings, "column": column})
+        serializer.is_valid(raise_exception=True)
+        item, after, before = (serializer.validated_data[name] for name in ("item", "after", "before"))
+        position = move(item, after, before)
+        return Response({"id": getattr(item, column), "order": position})
+
+
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
-class LabelViewSet(viewsets.ModelViewSet):
+class LabelViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Label.objects.all()
     serializer_class = LabelSerializer
 
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ReplicaReadMixin, VersionMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
+    values_rows = staticmethod(task_rows)
+    filter_backends = [ExtraFilter, OrderingFilter]
+    # ordering=-urgency is an index scan, see core.urgency
+    ordering_fields = ["urgency", "priority", "manual_order", "due_date", "creation_date"]
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the tasks. With ``include_archived=true``, a page of archived tasks is listed after them,
+        the most recently completed first: ``archived_limit`` of them, after the archived task ``archived_after``.
+        """
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get("include_archived") in ("1", "true") and self.paginator is None:
+            response.data.extend(self.archived_rows(request.query_params))
+        return response
+
+    def archived_rows(self, params):
+        try:
+            limit = min(int(params.get("archived_limit", settings.ARCHIVED_PAGE_SIZE)), settings.ARCHIVED_PAGE_MAX)
+            after = uuid.UUID(params["archived_after"]) if params.get("archived_after") else None
+        except ValueError:
+            raise ValidationError("archived_limit must be an integer and archived_after an archived task id")
+        queryset = ArchivedTask.objects.order_by("-completion_date", "-id")
+        if after is not None:
+            last = ArchivedTask.objects.filter(pk=after).values_list("completion_date", flat=True).first()
+            if last is None:
+                raise ValidationError("No such archived task: {}".format(after))
+            queryset = queryset.filter(Q(completion_date__lt=last) | Q(completion_date=last, id__lt=after))
+        return archived_task_rows(queryset[:limit])
+
+    @action(detail=False)
+    def board(self, request):
+        """Status columns with their counts and first ``limit`` tasks, and task counts per group and status."""
+        try:
+            limit = min(int(request.query_params.get("limit", 20)), settings.BOARD_MAX_TASKS)
+        except ValueError:
+            limit = 20
+        return Response(get_board(max(limit, 0)))
+
+    @action(detail=False)
+    def blocked(self, request):
+        """Ids of the pending tasks waiting for other pending tasks."""
+        return Response(get_graph().blocked())
+
+    @action(detail=False)
+    def unblocked(self, request):
+        """Ids of the pending tasks whose dependencies are all done."""
+        return Response(get_graph().unblocked())
+
+    @action(detail=False, url_path="topological-order")
+    def topological_order(self, request):
+        """Ids of the tasks in dependency order, and the dependency cycles keeping some tasks out of it."""
+        graph = get_graph()
+        return Response({"order": graph.topological_order(), "cycles": graph.cycles()})
+
+    @action(detail=False, url_path="critical-path")
+    def critical_path(self, request):
+        """The longest chain of dependencies, using the ``min`` or ``max`` (default) durations of the tasks."""
+        duration = request.query_params.get("duration", "max")
+        if duration not in ("min", "max"):
+            raise ValidationError("duration must be min or max")
+        return Response(get_graph().critical_path(duration))
+
+    @action(detail=False)
+    def calendar(self, request):
+        """
+        The tasks due in a window (``start`` and ``end`` query parameters), including the occurrences
+        of recurring tasks. Occurrences that were never touched are generated, and have no ``id``.
+        """
+        serializer = WindowSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start, end = serializer.validated_data["start"], serializer.validated_data["end"]
+        single = Task.objects.filter(
+            recurrence="", recurrence_parent__isnull=True, due_date__gte=start, due_date__lt=end
+        ).order_by("due_date")
+        return Response({"tasks": task_rows(single), "occurrences": expand(Task.objects.all(), start, end)})
+
+    @action(detail=True, methods=["post"])
+    def occurrence(self, request, pk=None):
+        """Store an occurrence of a recurring task (``{"occurrence_date": ...}``) to edit it as a task."""
+        template = self.get_object()
+        serializer = OccurrenceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            task = materialize(template, serializer.validated_data["occurrence_date"])
+        except ValueError as error:
+            raise ValidationError({"occurrence_date": str(error)})
+        return Response(self.get_serializer(task).data)
+
+    @action(detail=True, methods=["post"])
+    def move(self, request, pk=None):
+        """Move a task right after and/or before other tasks: only its own row is updated."""
+        task = self.get_object()
+        serializer = MoveSerializer(data=request.data, context={"task": task})
+        serializer.is_valid(raise_exception=True)
+        position = move(task, serializer.validated_data.get("after"), serializer.validated_data.get("before"))
+        return Response({"id": task.id, "manual_order": position})
+
+    @action(detail=False, methods=["post"])
+    def reorder(self, request):
+        """Apply a list of moves (``[{"task": id, "after": id, "before": id}, ...]``) in one transaction."""
+        serializer = MoveSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        positions = []
+        with transaction.atomic():
+            for data in serializer.validated_data:
+                task = data["task"]
+                # earlier moves of the batch may have changed the neighbors positions
+                neighbors = [data.get(n) for n in ("after", "before")]
+                for neighbor in neighbors:
+                    if neighbor is not None:
+                        neighbor.refresh_from_db(fields=["manual_order"])
+                positions.append({"id": task.id, "manual_order": move(task, *neighbors)})
+        return Response(positions)
+
+
+class ArchivedTaskViewSet(ReplicaReadMixin, mixins.DestroyModelMixin, viewsets.ReadOnlyModelViewSet):
+    """Completed tasks moved out of the task table by ``manage.py archive_tasks``."""
+
+    queryset = ArchivedTask.objects.order_by("-completion_date")
+    serializer_class = ArchivedTaskSerializer
+
+    @action(detail=True, methods=["post"])
+    def restore(self, request, pk=None):
+        task = restore_task(self.get_object())
+        return Response(TaskSerializer(task).data)
+
+
+class SyncJobViewSet(ReplicaReadMixin, mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Enqueue sync jobs and follow their progress.
+
+    Jobs are run by ``manage.py sync_worker`` processes, not by the web workers.
+    They run with the server's credentials, so only staff users can create and see them.
+    """
+
+    permission_classes = [IsAdminUser]
+    queryset = SyncJob.objects.order_by("-creation_date")
+    serializer_class = SyncJobSerializer